@@ -0,0 +1,208 @@
+
+import os
+import glob
+import time
+import json
+import logging
+
+
+# Times to list a pattern whose
+# directories keep changing
+MaxListAttempts = 3
+
+# Directories modified less than this many seconds
+# ago may change again within the same mtime
+RacyTime = 2.0
+
+
+class GlobCache():
+    """ A cache of the files matched by glob patterns
+
+    Listing large directories (especially on network
+    filesystems) is slow.  For each pattern, remember
+    the files it matched and the modification time of
+    every directory that had to be listed to find them.
+    A file being added to or removed from a directory
+    changes that directory's mtime, so the stored list
+    is still valid as long as none of them changed:
+    checking costs one stat per directory rather than
+    a full listing.
+
+    If a 'cacheDir' is given, the manifests are
+    stored there (in cacheDir/globs.json) and
+    reused by later runs.
+    """
+
+    def __init__( self, cacheDir=None ):
+        self.Manifests = {}
+        self.ManifestPath = None
+        self.SetCacheDir( cacheDir )
+
+
+    def SetCacheDir( self, cacheDir ):
+        """ Set the directory in which to store the manifests
+
+        None keeps them in memory only
+        """
+        if cacheDir == None:
+            self.ManifestPath = None
+            return
+        if not os.path.exists( cacheDir ):
+            os.makedirs( cacheDir )
+        self.ManifestPath = os.path.join( cacheDir, "globs.json" )
+        self.LoadManifests()
+
+
+    def GetKey( self, pattern ):
+        """ Return the key of a pattern
+
+        Relative patterns depend on the working directory
+        """
+        return os.path.join( os.getcwd(), pattern )
+
+
+    def Glob( self, pattern ):
+        """ Return the files matching a pattern, like glob.glob
+
+        """
+        key = self.GetKey( pattern )
+
+        manifest = self.Manifests.get( key )
+        if manifest != None and self.IsValid( manifest ):
+            return list( manifest["Files"] )
+
+        logging.debug( "GlobCache - \t Listing files matching: %s" % pattern )
+
+        # Stat the directories before listing them: a
+        # file added meanwhile changes their mtime after
+        # the one recorded, so the list is redone next
+        # time rather than missing it for good.  Retry
+        # if the directories themselves changed.
+        for attempt in range( MaxListAttempts ):
+            dirs = GetGlobDirs( pattern )
+            dirTimes = StatDirs( dirs )
+            files = glob.glob( pattern )
+            if GetGlobDirs( pattern ) == dirs:
+                break
+        else:
+            logging.debug( "GlobCache - \t Directories keep changing, not keeping the list: %s" % pattern )
+            return list( files )
+
+        # With coarse mtimes, a change in the same
+        # tick as the stat can't be seen: don't
+        # keep lists of just modified directories
+        now = time.time()
+        if any( [ mtime != None and now - mtime < RacyTime for (dir, mtime) in dirTimes ] ):
+            logging.debug( "GlobCache - \t Not keeping the list of recently changed files: %s" % pattern )
+            return list( files )
+
+        self.Manifests[ key ] = { "Files" : files, "Dirs" : dirTimes }
+        if self.ManifestPath != None:
+            self.SaveManifests()
+
+        return list( files )
+
+
+    def IsValid( self, manifest ):
+        """ Return whether none of a manifest's directories changed
+
+        """
+        for (dir, mtime) in manifest["Dirs"]:
+            try:
+                if os.stat( dir ).st_mtime != mtime:
+                    return False
+            except OSError:
+                if mtime != None:
+                    return False
+        return True
+
+
+    def LoadManifests( self ):
+        """ Load the stored manifests, if there are any
+
+        """
+        if not os.path.exists( self.ManifestPath ):
+            return
+        try:
+            input = open( self.ManifestPath )
+            stored = json.load( input )
+            input.close()
+        except Exception, e:
+            logging.warning( "GlobCache - Ignoring unreadable manifests %s (%s)" % (self.ManifestPath, e) )
+            return
+        for (key, manifest) in stored.iteritems():
+            if key not in self.Manifests:
+                # json gives unicode: keep paths as str
+                manifest["Files"] = [ file.encode( "utf-8" ) for file in manifest["Files"] ]
+                manifest["Dirs"]  = [ [ dir.encode( "utf-8" ), mtime ] for (dir, mtime) in manifest["Dirs"] ]
+                self.Manifests[ key.encode( "utf-8" ) ] = manifest
+
+
+    def SaveManifests( self ):
+        """ Store the manifests
+
+        """
+        tmpPath = "%s.%s.tmp" % (self.ManifestPath, os.getpid())
+        output = open( tmpPath, "w" )
+        json.dump( self.Manifests, output )
+        output.close()
+        os.rename( tmpPath, self.ManifestPath )
+
+
+    def Clear( self ):
+        """ Forget every manifest
+
+        """
+        self.Manifests = {}
+        if self.ManifestPath != None and os.path.exists( self.ManifestPath ):
+            os.remove( self.ManifestPath )
+
+
+def StatDirs( dirs ):
+    """ Return a list of [ dir, mtime ] (None if it doesn't exist)
+
+    """
+    dirTimes = []
+    for dir in dirs:
+        try:
+            dirTimes.append( [ dir, os.stat( dir ).st_mtime ] )
+        except OSError:
+            dirTimes.append( [ dir, None ] )
+    return dirTimes
+
+
+def GetGlobDirs( pattern ):
+    """ Return the directories whose contents decide what a pattern matches
+
+    These are the directories holding each path
+    component from the first one with a wildcard
+    (or the last one, if there are none, as that file
+    may appear or disappear) onwards, including those
+    without wildcards below a wildcard, since they
+    may be renamed or removed.
+    """
+
+    components = pattern.split( os.sep )
+
+    first = len( components ) - 1
+    for (index, component) in enumerate( components ):
+        if glob.has_magic( component ):
+            first = index
+            break
+
+    dirs = []
+    for index in range( first, len( components ) ):
+        parent = os.sep.join( components[ : index ] )
+        if index > 0 and parent == "":
+            parent = os.sep
+        if parent == "":
+            parent = os.curdir
+        if glob.has_magic( parent ):
+            parents = sorted( [ path for path in glob.glob( parent ) if os.path.isdir( path ) ] )
+        else:
+            parents = [ parent ]
+        for dir in parents:
+            if dir not in dirs:
+                dirs.append( dir )
+
+    return dirs
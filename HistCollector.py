@@ -1,7 +1,32 @@
 
-import ROOT
+import os
+import sys
+import time
+import json
 import logging
 
+# ROOT is only needed to make TH1s.  Without
+# it, a HistCollector with a ROOT-free reader
+# (see HistReaders) can still return bin data
+try:
+    import ROOT
+except ImportError:
+    ROOT = None
+
+from HistData import HistToData, DataToHist
+from HistDiskCache import HistDiskCache
+from KeyIndex import KeyIndex
+from GlobCache import GlobCache
+from HistMerger import HistMerger
+from HistReaders import ROOTReader
+
+# Import native OrderedDict, or use
+# local version for python < 2.7
+if sys.version_info >= (2, 7):
+    from collections import OrderedDict
+else:
+    from OrderedDict import *
+
 
 class HistCollector():
     """ A cache for histograms
@@ -10,64 +35,731 @@ class HistCollector():
     gather histograms from ROOT files.
     It can also act as a chache
     to speed up performance.
+
+    Files are kept open in a pool of
+    read-only TFiles so that repeated
+    lookups into the same file don't have
+    to re-open it and re-read its keys.
+    Once more than 'maxOpenFiles' files
+    are open, the least recently used
+    one is closed.
+
+    Cached histograms are also kept in
+    least recently used order.  If
+    'maxCacheBytes' is set, the oldest
+    histograms are evicted once the
+    approximate size of the cache
+    exceeds that budget.
+
+    If a 'cacheDir' is given, histograms
+    are also stored on disk there (see
+    :py:class:`HistDiskCache.HistDiskCache`)
+    so that later processes can skip
+    reading unchanged input files.
+
+    By default, files are read with ROOT.  A
+    different 'reader' (see :py:mod:`HistReaders`)
+    can be given, eg a :py:class:`HistReaders.UprootReader`
+    which doesn't need ROOT.  Use
+    :py:meth:`~HistCollector.HistCollector.GetHistData`
+    to get bin data without ever making a TH1.
+
+    Counters of what the cache does (hits, misses,
+    files opened, histograms cloned, bytes read and
+    time spent) are kept in 'Stats', see
+    :py:meth:`~HistCollector.HistCollector.PrintStats`
     """
 
-    def __init__( self ):
-        self.FileHistCache = {}
-        
+    def __init__( self, maxOpenFiles=32, maxCacheBytes=None, cacheDir=None, reader=None ):
+        self.FileHistCache = OrderedDict()
+        self.FileHistSizes = {}
+        self.CacheBytes = 0
+        self.MaxCacheBytes = maxCacheBytes
+
+        # The pool of open files, ordered
+        # from least to most recently used
+        self.OpenFiles = OrderedDict()
+        self.MaxOpenFiles = max( 1, maxOpenFiles )
+
+        self.DiskCache = None
+        self.KeyIndex = KeyIndex()
+        self.GlobCache = GlobCache()
+
+        # (file, name) pairs known to be missing ->
+        # (error message, the file's (size, mtime))
+        self.MissingHists = {}
+
+        self.ResetStats()
+
+        # Merging of large file lists
+        # across worker processes
+        self.Merger = None
+        self.MergeMinFiles = None
+
+        # None means reading through
+        # the pool of open TFiles
+        self.Reader = reader
+        if cacheDir != None:
+            self.SetCacheDir( cacheDir )
+
+
+    def ResetStats( self ):
+        """ Set all counters of cache activity back to 0
+
+        """
+        self.Stats = OrderedDict()
+        for counter in StatsCounters:
+            if counter.startswith( "Time" ):
+                self.Stats[ counter ] = 0.0
+            else:
+                self.Stats[ counter ] = 0
+
+
+    def GetStats( self ):
+        """ Return a copy of the counters of cache activity
+
+        Times are in seconds, sizes in bytes
+        """
+        stats = OrderedDict( self.Stats )
+        stats[ "CachedHists" ] = len( self.FileHistCache )
+        stats[ "CacheBytes" ] = self.CacheBytes
+        stats[ "OpenFiles" ] = len( self.OpenFiles )
+        return stats
+
+
+    def PrintStats( self ):
+        """ Print a summary of the cache activity
+
+        The hit rate is that of the per-file histograms
+        looked up to be used (by GetHist and GetHistData).
+        Merged histograms found in the cache are
+        counted separately, as MergedHits.
+        """
+        stats = self.GetStats()
+        lookups = stats["CacheHits"] + stats["CacheMisses"]
+        hitRate = 0.0
+        if lookups > 0:
+            hitRate = 100.0 * stats["CacheHits"] / lookups
+        print "HistCollector: %s cache lookups, %.1f%% hits" % (lookups, hitRate)
+        for (counter, value) in stats.iteritems():
+            if isinstance( value, float ):
+                print "    %-20s %.3f" % (counter, value)
+            else:
+                print "    %-20s %s" % (counter, value)
+
+
+    def DumpStats( self, path ):
+        """ Write the counters of cache activity to a JSON file
+
+        """
+        output = open( path, "w" )
+        json.dump( self.GetStats(), output, indent=2 )
+        output.close()
+
+
+    def SetCacheDir( self, cacheDir ):
+        """ Set the directory of the persistent on-disk cache
+
+        The indices of the input files' keys
+        (see :py:class:`KeyIndex.KeyIndex`) and
+        the files matched by glob patterns (see
+        :py:class:`GlobCache.GlobCache`) are
+        stored there as well.
+        None turns the on-disk cache off
+        """
+        if cacheDir == None:
+            self.DiskCache = None
+        else:
+            self.DiskCache = HistDiskCache( cacheDir )
+        self.KeyIndex.SetCacheDir( cacheDir )
+        self.GlobCache.SetCacheDir( cacheDir )
+        if self.Merger != None:
+            self.Merger.DiskCache = self.DiskCache
+
+
+    def Glob( self, pattern ):
+        """ Return the files matching a glob pattern
+
+        The result is remembered for as long as the
+        directories it was found in don't change
+        """
+        return self.GlobCache.Glob( pattern )
+
+
+    def SetReader( self, reader ):
+        """ Set the backend used to read histograms
+
+        See :py:mod:`HistReaders`.  None means reading
+        with ROOT through the pool of open files.
+        """
+        self.Reader = reader
+        if self.Merger != None:
+            self.Merger.Reader = self.GetWorkerReader()
+
+
+    def GetWorkerReader( self ):
+        """ Return the reader to send to worker processes
+
+        """
+        if self.Reader == None:
+            return ROOTReader()
+        return self.Reader
+
+
+    def GetKeyIndex( self, file ):
+        """ Return the index of all keys in a file
+
+        See :py:meth:`KeyIndex.KeyIndex.GetKeys`
+        """
+        return self.KeyIndex.GetKeys( file, self.GetFile )
+
+
+    def GetReadPlan( self, fileHistMap ):
+        """ Return a file -> hist list map in the order to read it
+
+        The files are sorted by path, and each file's
+        histograms by their position in the file (from
+        its key index), so that they're read in one
+        pass over the file.  Names are deduplicated.
+        Only indices already in memory or on disk are
+        used: files are never opened here (that is
+        left to the readers), so the histograms of a
+        file that isn't indexed yet keep their order.
+        """
+
+        plan = OrderedDict()
+        for file in sorted( fileHistMap.keys() ):
+
+            histList = []
+            for name in fileHistMap[ file ]:
+                if name not in histList:
+                    histList.append( name )
+
+            try:
+                if self.KeyIndex.GetStoredKeys( file ) != None:
+                    histList.sort( key=lambda name: self.GetSeek( file, name ) )
+            except OSError, e:
+                logging.debug( "HistCollector - \t Can't order reads of %s (%s)" % (file, e) )
+
+            plan[ file ] = histList
+
+        return plan
+
+
+    def GetSeek( self, file, name ):
+        """ Return the position of a histogram in an indexed file
+
+        Histograms that aren't in the file
+        are put after all others
+        """
+        entry = self.KeyIndex.GetIndexedEntry( file, GetKeyPath( name ) )
+        if entry == None:
+            return sys.maxint
+        return entry["Seek"]
+
+
+    def HasHist( self, file, name ):
+        """ Return whether a file holds a histogram of the given name
+
+        This usually only needs the file's key index, so
+        it doesn't read the histogram itself.  Names the
+        index doesn't know (eg with an unusual cycle) are
+        checked by getting them from the file, as
+        :py:meth:`~HistCollector.HistCollector.ReadHist` would.
+        """
+        entry = self.KeyIndex.GetEntry( file, GetKeyPath( name ), self.GetFile )
+        if entry != None:
+            return entry["IsHist"]
+
+        logging.debug( "HistCollector - \t Not in key index, getting: %s %s" % (file, name) )
+        hist = self.GetFile( file ).Get( name )
+        return bool( hist ) and hist.InheritsFrom( "TH1" )
+
+
+    def GetMissingHistMessage( self, file, name ):
+        """ Describe a histogram missing from a file
+
+        Suggest the closest histogram names in that file
+        """
+        message = "Histogram '" + name + "' not found in file '" + file + "'"
+        try:
+            similar = self.KeyIndex.FindSimilar( file, name, self.GetFile )
+        except Exception:
+            return message
+        if len( similar ) > 0:
+            message += " (similar: %s)" % ", ".join( similar )
+        return message
+
+
+    def AddMissingHist( self, file, name, message ):
+        """ Remember that a histogram is missing from a file
+
+        Later lookups of it fail without opening the file,
+        for as long as the file's size and mtime don't change
+        """
+        self.MissingHists[ (file, name) ] = ( message, GetFileStamp( file ) )
+        return message
+
+
+    def GetMissingMessage( self, file, name ):
+        """ Return why a histogram is known to be missing, or None
+
+        Forget it if its file changed since
+        """
+        entry = self.MissingHists.get( (file, name) )
+        if entry == None:
+            return None
+        (message, stamp) = entry
+        if GetFileStamp( file ) != stamp:
+            logging.debug( "HistCollector - \t File changed, forgetting missing hist: %s %s" % (file, name) )
+            del self.MissingHists[ (file, name) ]
+            return None
+        return message
+
+
+    def CheckNotMissing( self, file, name ):
+        """ Raise straight away if a histogram is known to be missing
+
+        """
+        message = self.GetMissingMessage( file, name )
+        if message != None:
+            raise IOError( 5, message )
+
+
+    def FindMissingHists( self, fileHistMap ):
+        """ Check that every hist of a file -> hist list map exists
+
+        Only the files' key indices are read (see
+        :py:meth:`~HistCollector.HistCollector.HasHist`).
+        Return a list of (file, name, message) for every
+        histogram that is missing (or whose file can't
+        be opened).  These are also remembered, so that
+        reading them later fails straight away.
+        """
+
+        missing = []
+        if ROOT == None:
+            logging.warning( "HistCollector - Can't check for missing hists without ROOT" )
+            return missing
+
+        for (file, histList) in fileHistMap.iteritems():
+            for name in histList:
+                message = self.GetMissingMessage( file, name )
+                if message == None:
+                    try:
+                        if not self.HasHist( file, name ):
+                            message = self.GetMissingHistMessage( file, name )
+                    except (IOError, OSError), e:
+                        message = "File '%s' could not be read (%s)" % (file, e)
+                    if message != None:
+                        self.AddMissingHist( file, name, message )
+                if message != None:
+                    missing.append( (file, name, message) )
+
+        return missing
+
 
     def ClearCache( self ):
         self.FileHistCache.clear()
+        self.FileHistSizes.clear()
+        self.CacheBytes = 0
+        self.MissingHists.clear()
+
+
+    def SetMaxCacheBytes( self, maxCacheBytes ):
+        """ Set the approximate size limit of the cache in bytes
+
+        None means no limit.  If the cache is already
+        larger than the new limit, histograms are
+        evicted until it fits.
+        """
+        self.MaxCacheBytes = maxCacheBytes
+        self.EvictHists()
+
+
+    def AddToCache( self, file, name, hist ):
+        """ Store a histogram in the cache
+
+        The cache takes ownership of the histogram
+        (and detaches it from any ROOT directory, so
+        that gROOT.DeleteAll() can't delete it).
+        Least recently used histograms are evicted
+        if this pushes the cache over its budget.
+        """
+        key = (file, name)
+        if key in self.FileHistCache:
+            self.RemoveFromCache( file, name )
+
+        hist.SetDirectory( 0 )
+
+        size = GetHistSize( hist )
+        self.FileHistCache[ key ] = hist
+        self.FileHistSizes[ key ] = size
+        self.CacheBytes += size
+        self.EvictHists()
+
+
+    def GetFromCache( self, file, name ):
+        """ Return a cached histogram, or None if it isn't cached
+
+        The histogram is marked as the most recently used.
+        The returned object is owned by the cache:
+        clone it before modifying it.
+        This isn't counted in the hits and misses, see
+        :py:meth:`~HistCollector.HistCollector.LookUp`
+        """
+        key = (file, name)
+        if key not in self.FileHistCache:
+            return None
+        hist = self.FileHistCache.pop( key )
+        self.FileHistCache[ key ] = hist
+        return hist
+
+
+    def LookUp( self, file, name ):
+        """ Return a cached histogram like GetFromCache, counting a hit or miss
+
+        Only lookups of histograms about to be used are
+        counted, not checks of what needs reading
+        """
+        hist = self.GetFromCache( file, name )
+        if hist == None:
+            self.Stats["CacheMisses"] += 1
+        else:
+            self.Stats["CacheHits"] += 1
+        return hist
+
+
+    def IsCached( self, file, name ):
+        """ Return whether a histogram is in the cache
+
+        Unlike :py:meth:`~HistCollector.HistCollector.GetFromCache`
+        this doesn't mark it as used
+        """
+        return (file, name) in self.FileHistCache
+
+
+    def RemoveFromCache( self, file, name ):
+        """ Remove a histogram from the cache and delete it
+
+        """
+        key = (file, name)
+        if key not in self.FileHistCache:
+            return
+        hist = self.FileHistCache.pop( key )
+        self.CacheBytes -= self.FileHistSizes.pop( key )
+        hist.Delete()
+        del hist
+
+
+    def EvictHists( self ):
+        """ Evict least recently used histograms until under budget
+
+        """
+        if self.MaxCacheBytes == None:
+            return
+        while self.CacheBytes > self.MaxCacheBytes and len( self.FileHistCache ) > 0:
+            (file, name) = self.FileHistCache.keys()[0]
+            source = file
+            if isinstance( file, tuple ):
+                source = "(merged over %s files)" % len( file )
+            logging.info( "HistCollector - \t Evicting from cache: %s %s (%s bytes, cache holds %s of %s bytes)" 
+                          % (source, name, self.FileHistSizes[ (file, name) ], 
+                             self.CacheBytes, self.MaxCacheBytes) )
+            self.RemoveFromCache( file, name )
+            self.Stats["Evictions"] += 1
+
+
+    def SetMaxOpenFiles( self, maxOpenFiles ):
+        """ Set the maximum number of files kept open
+
+        Files beyond this limit are closed, least
+        recently used first.  At least one file
+        is always kept open.
+        """
+        self.MaxOpenFiles = max( 1, maxOpenFiles )
+        while len( self.OpenFiles ) > self.MaxOpenFiles:
+            self.CloseFile( self.OpenFiles.keys()[0] )
+
+
+    def GetFile( self, file ):
+        """ Return an open TFile for the given file name
+
+        If the file is already in the pool, mark it
+        as the most recently used and return it.
+        Otherwise, open it (closing the least recently
+        used file if the pool is full) and add it.
+        The pool owns the file: don't close it yourself,
+        use :py:meth:`~HistCollector.HistCollector.CloseFile`
+        """
+
+        if file in self.OpenFiles:
+            logging.debug( "HistCollector - \t File already open: %s" % file )
+            tfile = self.OpenFiles.pop( file )
+            self.OpenFiles[ file ] = tfile
+            return tfile
+
+        while len( self.OpenFiles ) >= self.MaxOpenFiles:
+            self.CloseFile( self.OpenFiles.keys()[0] )
+
+        logging.debug( "HistCollector - \t Opening File: %s" % file )
+        start = time.time()
+        #tfile = ROOT.TFile.Open( file, "READ" )
+        tfile = ROOT.TFile( file )
+        self.Stats["TimeOpen"] += time.time() - start
+        if not tfile or tfile.IsZombie():
+            raise IOError( 1, "File '" + file + "' could not be opened" )
+        ROOT.gROOT.cd()
+        self.Stats["FileOpens"] += 1
+
+        self.OpenFiles[ file ] = tfile
+        return tfile
+
+
+    def CloseFile( self, file ):
+        """ Close a pooled file and remove it from the pool
+
+        """
+        if file not in self.OpenFiles:
+            return
+        logging.debug( "HistCollector - \t Closing File: %s" % file )
+        tfile = self.OpenFiles.pop( file )
+        tfile.Close()
+        tfile.Delete()
+        del tfile
+
+
+    def CloseAllFiles( self ):
+        """ Close every file in the pool
+
+        """
+        for file in self.OpenFiles.keys():
+            self.CloseFile( file )
 
 
     def GetHist( self, file, name, cache=False ):
         """ Get the histogram with the given from a file
-        
+
         This is a simple function, but it's important
         for it to be verbose in logging and to clean
-        up for itself.  We want to avoid some of 
+        up for itself.  We want to avoid some of
         PyROOT's memory issues
         """
-        
+
         logging.debug( "HistCollector - \t Getting File %s Hist %s" %  (file, name) )
 
         # Check if the hist is in the cache:
-        if (file, name) in self.FileHistCache:
+        # The caller owns what we return, so
+        # hand back a copy of the cached hist
+        cachedHist = self.LookUp( file, name )
+        if cachedHist != None:
             logging.debug( "HistCollector - \t Found in cache: %s %s" % (file, name) )
-            return FileHistCache[ (file, name) ]
-        
+            return self.CloneHist( cachedHist )
+
         logging.debug( "HistCollector - \t Not in cache: %s %s" % (file, name) )
-        logging.debug( "HistCollector - \t Opening File: %s" % file )
-        #tfile = ROOT.TFile.Open( file, "READ" )
-        tfile = ROOT.TFile( file )
-        if not tfile:
-            raise IOError( 1, "File '" + file + "' could not be opened" )
+        returnHist = self.ReadHist( file, name )
+
+        if returnHist.GetEntries() == 0 :
+            logging.debug(" GetHist - Hist: %s in file: %s has 0 entries" % (name, file) )
+
+        if cache:
+            self.AddToCache( file, name, self.CloneHist( returnHist ) )
+
+        return returnHist
+
+
+    def CloneHist( self, hist ):
+        """ Return a copy of a histogram, made in ROOT's memory directory
+
+        """
+        start = time.time()
+        ROOT.gROOT.cd()
+        clone = hist.Clone()
+        self.Stats["TimeClone"] += time.time() - start
+        self.Stats["HistsCloned"] += 1
+        return clone
+
+
+    def GetMergedHist( self, files, name ):
+        """ Return a copy of a memoized merged histogram, or None
+
+        Merged histograms are the sum of the histogram
+        'name' over every file in 'files' (see
+        :py:func:`helpers.tools.GetHist`).  The name
+        should be fully resolved (including any prefix).
+        They share the cache, and its byte budget,
+        with the per-file histograms.
+        """
+        cachedHist = self.GetFromCache( tuple(files), name )
+        if cachedHist == None:
+            return None
+        self.Stats["MergedHits"] += 1
+        logging.debug( "HistCollector - \t Found merged hist in cache: %s (%s files)" % (name, len(files)) )
+        return self.CloneHist( cachedHist )
+
+
+    def CacheMergedHist( self, files, name, hist ):
+        """ Memoize the merge of histogram 'name' over 'files'
+
+        A copy of the histogram is stored, so the
+        caller is free to keep modifying its own.
+        """
+        self.AddToCache( tuple(files), name, self.CloneHist( hist ) )
+
+
+    def SetParallelMerge( self, nWorkers, minFiles=100, chunkSize=50, partialDir=None ):
+        """ Merge histograms over large file lists in parallel
+
+        Histograms spread over at least 'minFiles' files
+        are merged by 'nWorkers' processes (see
+        :py:class:`HistMerger.HistMerger`).  If nWorkers
+        is 1 or less, merging is done here, file by file.
+        """
+        if self.Merger != None:
+            self.Merger.Close()
+        if nWorkers <= 1:
+            self.Merger = None
+            return
+        self.Merger = HistMerger( nWorkers, chunkSize, partialDir, self.GetWorkerReader(), self.DiskCache )
+        self.MergeMinFiles = minFiles
+
+
+    def MergeHistParallel( self, files, name ):
+        """ Merge a histogram over a large file list in parallel
+
+        Return the merged histogram, or None if
+        parallel merging is off, there are too few
+        files, or the histogram can't be merged that way.
+
+        Histograms already read into this process (eg
+        by :py:meth:`~HistCollector.HistCollector.CacheHists`)
+        aren't read again: if any file's histogram is
+        cached, return None to merge here instead.
+        Histograms known to be missing raise straight away.
+        """
+        if self.Merger == None or len( files ) < self.MergeMinFiles:
+            return None
+        for file in files:
+            self.CheckNotMissing( file, name )
+            if self.IsCached( file, name ):
+                return None
+        start = time.time()
+        try:
+            data = self.Merger.Merge( files, name )
+        except IOError, e:
+            # Let the merge here find (and
+            # remember) what couldn't be read
+            logging.debug( "HistCollector - \t Parallel merge of %s failed: %s" % (name, e) )
+            return None
+        finally:
+            self.Stats["TimeMerge"] += time.time() - start
+        self.Stats["ParallelMerges"] += 1
+        if data == None:
+            return None
+        return DataToHist( data, name )
+
+
+    def GetHistData( self, file, name ):
+        """ Return the bin data of a histogram (see HistData)
+
+        With a ROOT-free reader, this never needs ROOT:
+        the data comes from the on-disk cache or
+        straight from the reader.
+        """
+
+        cachedHist = self.LookUp( file, name )
+        if cachedHist != None:
+            data = HistToData( cachedHist )
+            if data != None:
+                return data
+
+        self.CheckNotMissing( file, name )
+
+        if self.DiskCache != None:
+            data = self.DiskCache.Get( file, name )
+            if data != None:
+                logging.debug( "HistCollector - \t Found on disk: %s %s" % (file, name) )
+                self.Stats["DiskHits"] += 1
+                return data
+
+        if self.Reader != None:
+            data = self.ReadWithReader( file, name )
+            if data != None:
+                if self.DiskCache != None:
+                    self.DiskCache.Put( file, name, data )
+                return data
+
+        return HistToData( self.ReadHist( file, name ) )
+
+
+    def ReadWithReader( self, file, name ):
+        """ Return the data of a histogram read by the custom reader
+
+        """
+        start = time.time()
+        try:
+            data = self.Reader.ReadHistData( file, [name] )[0][1]
+            self.Stats["HistsRead"] += 1
+            return data
+        except IOError, e:
+            if e.errno == 5:
+                self.AddMissingHist( file, name, e.strerror )
+            raise
+        finally:
+            self.Stats["TimeRead"] += time.time() - start
+
+
+    def ReadHist( self, file, name ):
+        """ Read a histogram, skipping the in-memory cache
+
+        If there is an on-disk cache, look there first.
+        Otherwise, get the histogram from the (pooled)
+        file and store it on disk for next time.
+        The returned histogram is owned by the caller.
+        """
+
+        self.CheckNotMissing( file, name )
+
+        if self.DiskCache != None:
+            data = self.DiskCache.Get( file, name )
+            if data != None:
+                logging.debug( "HistCollector - \t Found on disk: %s %s" % (file, name) )
+                self.Stats["DiskHits"] += 1
+                return DataToHist( data )
+
+        if self.Reader != None:
+            data = self.ReadWithReader( file, name )
+            if data != None:
+                if self.DiskCache != None:
+                    self.DiskCache.Put( file, name, data )
+                return DataToHist( data )
+
+        tfile = self.GetFile( file )
 
         logging.debug( "HistCollector - \t Getting Hist: %s" % name )
+        start = time.time()
+        bytesRead = tfile.GetBytesRead()
         ROOT.gROOT.cd()
         hist = tfile.Get( name )
+        self.Stats["TimeGet"] += time.time() - start
         if not hist:
-            raise IOError( 5, "Histogram '" + name + "' not found in file '" + file + "'" )
+            message = self.GetMissingHistMessage( file, name )
+            raise IOError( 5, self.AddMissingHist( file, name, message ) )
+        self.Stats["HistsRead"] += 1
+        self.Stats["BytesRead"] += tfile.GetBytesRead() - bytesRead
+        self.Stats["BytesDecompressed"] += GetKeyObjLen( tfile, name )
 
-        ROOT.gROOT.cd()
-        returnHist = hist.Clone()
+        returnHist = self.CloneHist( hist )
         hist.Delete()
         del hist
-        
-        if returnHist.GetEntries() == 0 :
-            logging.debug(" GetHist - Hist: %s in file: %s has 0 entries" % (name, file) )
-
-        if cache:
-            self.FileHistCache[ (file, name) ] = returnHist #.Clone()
-        
-        tfile.Close()
-        tfile.Delete() # Testing
-        del tfile
 
         if returnHist == None:
             print "Error: hist (%s, %s) is NONE" % (name, file)
             raise Exception("Hist")
-        
+
+        if self.DiskCache != None:
+            self.DiskCache.Put( file, name, HistToData( returnHist ) )
+
         return returnHist
 
 
@@ -84,40 +776,281 @@ class HistCollector():
         for hist in histList:
             logging.debug( "HistCollector - \t Going to cache hist: %s " %  (hist) )
 
-        #tfile = ROOT.TFile.Open( file, "READ" )
-        tfile = ROOT.TFile( file )
-        if not tfile:
-            raise IOError( 1, "File '" + file + "' could not be opened" )
-
         for name in histList:
 
             # Check if the hist is in the cache:
-            if (file, name) in self.FileHistCache:
+            if self.GetFromCache( file, name ) != None:
                 logging.debug( "HistCollector - \t Found in cache: %s %s" % (file, name) )
                 continue
-        
-            logging.debug( "HistCollector - \t Not in cache: %s %s" % (file, name) )
-            logging.debug( "HistCollector - \t Opening File: %s" % file )
-
-            logging.debug( "HistCollector - \t Getting Hist: %s" % name )
-            hist = tfile.Get( name )
-            if not hist:
-                raise IOError( 5, "Histogram '" + name + "' not found in file '" + file + "'" )
 
-            ROOT.gROOT.cd()
-            returnHist = hist.Clone()
-            #returnHist.Add( hist )
-            hist.Delete()
-            del hist
+            logging.debug( "HistCollector - \t Not in cache: %s %s" % (file, name) )
+            returnHist = self.ReadHist( file, name )
 
             if returnHist.GetEntries() == 0 :
                 logging.debug(" GetHist - Hist: %s in file: %s has 0 entries" % (name, file) )
 
-            self.FileHistCache[ (file, name) ] = returnHist #.Clone()
+            self.AddToCache( file, name, returnHist )
 
         # Got all histograms
-        # Now we're done
-        tfile.Close()
-        tfile.Delete()
-        del tfile
+        # The file stays in the pool
+        # for later lookups
+
+
+    def CacheHistsParallel( self, fileHistMap, nWorkers ):
+        """ Cache histograms from many files using worker processes
+
+        'fileHistMap' maps each file to a list of histogram
+        names.  The files are shared between a pool of
+        'nWorkers' processes, each of which opens its files
+        and sends back the bin contents, errors, edges and
+        labels of the requested histograms (see
+        :py:func:`HistData.HistToData`).  The histograms
+        are then rebuilt and cached here.
+
+        Histograms that are already cached (in memory or
+        on disk) aren't read again.  Those that can't be
+        sent as bins (eg TProfiles) are read here instead.
+        """
+
+        import multiprocessing
+
+        jobs = self.GetReadJobs( fileHistMap )
+
+        if len( jobs ) == 0:
+            return
+
+        nWorkers = min( nWorkers, len(jobs) )
+        logging.debug( "HistCollector - \t Reading %s files with %s workers" % (len(jobs), nWorkers) )
+
+        start = time.time()
+        pool = multiprocessing.Pool( processes=nWorkers )
+        try:
+            for (file, results) in pool.imap_unordered( ReadHistData, jobs ):
+                self.CacheHistData( file, results )
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            self.Stats["TimeParallelRead"] += time.time() - start
+
+
+    def GetReadJobs( self, fileHistMap ):
+        """ Return the reads needed to cache every hist in a map
+
+        'fileHistMap' maps files to lists of histogram names.
+        Return a list of (reader, file, histList) jobs for
+        :py:func:`ReadHistData` covering the histograms
+        that aren't cached yet.  Those found in the
+        on-disk cache are cached right away.
+        """
+        jobs = []
+        for (file, histList) in fileHistMap.iteritems():
+            pending = []
+            for name in histList:
+                if name in pending:
+                    continue
+                if self.GetFromCache( file, name ) != None:
+                    continue
+                if self.DiskCache != None:
+                    data = self.DiskCache.Get( file, name )
+                    if data != None:
+                        self.AddToCache( file, name, DataToHist( data ) )
+                        continue
+                pending.append( name )
+            if len( pending ) > 0:
+                jobs.append( (self.GetWorkerReader(), file, pending) )
+        return jobs
+
+
+    def CacheHistData( self, file, results ):
+        """ Cache the (name, data) pairs read from a file by a worker
+
+        Histograms the worker couldn't describe
+        (data is None) are read here instead.
+        """
+        for (name, data) in results:
+            self.Stats["HistsReceived"] += 1
+            if data == None:
+                logging.debug( "HistCollector - \t Reading unsupported hist here: %s %s" % (file, name) )
+                self.AddToCache( file, name, self.ReadHist( file, name ) )
+                continue
+            if self.DiskCache != None:
+                self.DiskCache.Put( file, name, data )
+            self.AddToCache( file, name, DataToHist( data ) )
+
+
+class HistPrefetcher():
+    """ Read histograms in background processes before they're needed
+
+    Histograms passed to :py:meth:`~HistPrefetcher.Prefetch`
+    are read by a pool of 'nWorkers' processes while
+    this process gets on with something else (eg drawing).
+    :py:meth:`~HistPrefetcher.Collect` then puts them in
+    the HistCollector's cache, waiting for them if needed.
+    """
+
+    def __init__( self, histCache, nWorkers=1 ):
+        import multiprocessing
+        self.HistCache = histCache
+        self.Pool = multiprocessing.Pool( processes=max( 1, nWorkers ) )
+        self.Submitted = set()
+        self.Jobs = []
+
+
+    def Prefetch( self, fileHistMap ):
+        """ Start reading every hist in a file -> hist list map
+
+        Histograms that are cached or already
+        being read aren't read again.
+        """
+        for (reader, file, histList) in self.HistCache.GetReadJobs( fileHistMap ):
+            histList = [ name for name in histList if (file, name) not in self.Submitted ]
+            if len( histList ) == 0:
+                continue
+            logging.debug( "HistPrefetcher - \t Prefetching %s hists from file %s" % (len(histList), file) )
+            pairs = set( [ (file, name) for name in histList ] )
+            self.Submitted.update( pairs )
+            job = self.Pool.apply_async( ReadHistData, [ (reader, file, histList) ] )
+            self.Jobs.append( (pairs, job) )
+
+
+    def Collect( self, fileHistMap ):
+        """ Cache the hists of a map, waiting for them if necessary
 
+        Any other reads that have finished are cached
+        at the same time.  Only the reads of this map
+        can raise: if another read failed it is
+        dropped, so that the request needing it reads
+        (and reports) its histograms itself.
+        """
+        needed = set()
+        for (file, histList) in fileHistMap.iteritems():
+            for name in histList:
+                needed.add( (file, name) )
+
+        for (pairs, job) in list( self.Jobs ):
+            isNeeded = len( pairs & needed ) > 0
+            if not isNeeded and not job.ready():
+                continue
+
+            # Collected reads can be prefetched again
+            # (eg once evicted from the cache)
+            self.Jobs.remove( (pairs, job) )
+            self.Submitted -= pairs
+
+            if isNeeded:
+                self.CollectJob( job )
+                continue
+            try:
+                self.CollectJob( job )
+            except Exception, e:
+                logging.debug( "HistPrefetcher - \t Dropping failed prefetch of %s hists (%s)" % (len(pairs), e) )
+
+
+    def CollectJob( self, job ):
+        """ Cache the results of a read, waiting for it if necessary
+
+        """
+        start = time.time()
+        (file, results) = job.get()
+        self.HistCache.Stats["TimeParallelRead"] += time.time() - start
+        self.HistCache.CacheHistData( file, results )
+
+
+    def Close( self ):
+        """ Stop the worker processes
+
+        """
+        self.Pool.terminate()
+        self.Pool.join()
+        self.Jobs = []
+
+
+# The counters of HistCollector.Stats
+StatsCounters = [ "CacheHits", "CacheMisses", "MergedHits", "DiskHits", "Evictions",
+                  "FileOpens", "HistsRead", "HistsReceived", "HistsCloned",
+                  "ParallelMerges", "BytesRead", "BytesDecompressed",
+                  "TimeOpen", "TimeGet", "TimeClone", "TimeRead", "TimeMerge",
+                  "TimeParallelRead" ]
+
+
+def GetKeyPath( name ):
+    """ Return the path of a histogram name as stored in a key index
+
+    TFile.Get also takes a leading '/' and
+    a ';N' cycle, which the index doesn't hold
+    """
+    name = name.lstrip( "/" )
+    (path, sep, cycle) = name.rpartition( ";" )
+    if sep != "" and cycle.isdigit():
+        name = path
+    return name
+
+
+def GetKeyObjLen( tfile, name ):
+    """ Return the uncompressed size of an object in a file
+
+    Only the in-memory list of keys is looked at.
+    Return 0 if the key can't be found.
+    """
+    (dirName, sep, baseName) = name.rpartition( "/" )
+    directory = tfile
+    if dirName != "":
+        directory = tfile.GetDirectory( dirName )
+    if not directory:
+        return 0
+    key = directory.GetKey( baseName )
+    if not key:
+        return 0
+    return key.GetObjlen()
+
+
+def ReadHistData( job ):
+    """ Read the bin data of several histograms from one file
+
+    Takes a (reader, file, histList) tuple and returns
+    (file, [ (name, data), ... ]) where data is made by
+    :py:func:`HistData.HistToData` (None for histograms
+    that it can't describe).  Meant to be run in a worker
+    process, see :py:meth:`HistCollector.CacheHistsParallel`
+    """
+
+    (reader, file, histList) = job
+    return (file, reader.ReadHistData( file, histList ))
+
+
+def GetFileStamp( file ):
+    """ Return the (size, mtime) of a file, or None if it can't be found
+
+    """
+    try:
+        stat = os.stat( file )
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def GetHistSize( hist ):
+    """ Return the approximate memory size of a histogram in bytes
+
+    Count 8 bytes per bin (including under/overflow)
+    for the contents and, if present, the sum of
+    squared weights, plus a fixed overhead for the
+    object, its axes and any bin labels.
+    """
+    nBins = hist.GetNbinsX() + 2
+    if hist.GetDimension() > 1:
+        nBins *= hist.GetNbinsY() + 2
+    if hist.GetDimension() > 2:
+        nBins *= hist.GetNbinsZ() + 2
+    nArrays = 1
+    if hist.GetSumw2N() > 0:
+        nArrays += 1
+    size = nBins * nArrays * 8
+    size += 1024 # Object and axis overhead
+    labels = hist.GetXaxis().GetLabels()
+    if labels:
+        size += 64 * labels.GetSize()
+    return size
@@ -0,0 +1,163 @@
+
+#
+# Convert histograms to and from plain python data:
+# a dictionary holding the bin contents, errors, edges
+# and labels of a histogram.  This can be pickled, stored
+# on disk or sent between processes without ROOT.
+#
+# This module doesn't need ROOT itself until one
+# asks it to build a histogram.
+#
+
+import re
+import array
+
+# Classes that can be rebuilt from their bins
+SupportedClasses = re.compile( "^TH[123][CSIFD]$" )
+
+
+def HistToData( hist ):
+    """ Return a dictionary describing a histogram
+
+    The dictionary holds:
+
+    + Class, Name, Title
+    + Edges:      a list of bin edges for each axis
+    + Labels:     a list of (bin, label) pairs for each axis
+    + AxisTitles: the title of each axis
+    + Contents:   the content of every bin (including under/overflow)
+    + Sumw2:      the sum of squared weights of every bin (or None)
+    + Entries:    the number of entries
+
+    Edges, Contents and Sumw2 may also be numpy
+    arrays (see :py:class:`HistReaders.UprootReader`).
+    Return None if the histogram's class
+    can't be rebuilt this way (TProfile, etc)
+    """
+
+    className = hist.ClassName()
+    if not SupportedClasses.match( className ):
+        return None
+
+    dimension = hist.GetDimension()
+    axes = [ hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis() ][ : dimension ]
+
+    edges = []
+    labels = []
+    for axis in axes:
+        nBins = axis.GetNbins()
+        edges.append( [ axis.GetBinLowEdge( bin+1 ) for bin in range(nBins) ] + [ axis.GetBinUpEdge( nBins ) ] )
+        axisLabels = []
+        if axis.GetLabels():
+            for bin in range( nBins ):
+                label = axis.GetBinLabel( bin+1 )
+                if label != "":
+                    axisLabels.append( (bin+1, label) )
+        labels.append( axisLabels )
+
+    nCells = 1
+    for axis in axes:
+        nCells *= axis.GetNbins() + 2
+
+    contents = [ hist.GetBinContent( cell ) for cell in range(nCells) ]
+
+    sumw2 = None
+    if hist.GetSumw2N() > 0:
+        sumw2Array = hist.GetSumw2()
+        sumw2 = [ sumw2Array[ cell ] for cell in range(nCells) ]
+
+    data = { "Class" : className, "Name" : hist.GetName(), "Title" : hist.GetTitle(),
+             "Edges" : edges, "Labels" : labels,
+             "AxisTitles" : [ axis.GetTitle() for axis in axes ],
+             "Contents" : contents, "Sumw2" : sumw2, "Entries" : hist.GetEntries() }
+
+    return data
+
+
+def DataToHist( data, name=None ):
+    """ Build a histogram from a dictionary made by HistToData
+
+    The histogram is created in ROOT's memory
+    directory (not in any open file).
+    """
+
+    import ROOT
+
+    if name is None:
+        name = data["Name"]
+
+    args = [ name, data["Title"] ]
+    for edges in data["Edges"]:
+        args.append( len(edges) - 1 )
+        args.append( array.array( 'd', edges ) )
+
+    ROOT.gROOT.cd()
+    hist = getattr( ROOT, data["Class"] )( *args )
+
+    if data["Sumw2"] is not None:
+        hist.Sumw2()
+
+    for (cell, content) in enumerate( data["Contents"] ):
+        hist.SetBinContent( cell, content )
+
+    if data["Sumw2"] is not None:
+        sumw2Array = hist.GetSumw2()
+        for (cell, sumw2) in enumerate( data["Sumw2"] ):
+            sumw2Array[ cell ] = sumw2
+
+    axes = [ hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis() ]
+    for (axis, axisLabels, title) in zip( axes, data["Labels"], data["AxisTitles"] ):
+        for (bin, label) in axisLabels:
+            axis.SetBinLabel( bin, label )
+        axis.SetTitle( title )
+
+    hist.SetEntries( data["Entries"] )
+
+    return hist
+
+
+
+def SameEdges( edgesA, edgesB ):
+    """ Return whether two lists of axis edges are the same
+
+    The edges of each axis may be lists or numpy
+    arrays (as made by :py:class:`HistReaders.UprootReader`)
+    """
+    if len( edgesA ) != len( edgesB ):
+        return False
+    for (axisA, axisB) in zip( edgesA, edgesB ):
+        if list( axisA ) != list( axisB ):
+            return False
+    return True
+
+
+def AddHistData( dataA, dataB ):
+    """ Return the sum of two histograms' data
+
+    Both must have the same class and binning.
+    If only one has a sum of squared weights, the
+    other's contents are used as its sum of squares
+    (as ROOT does for unweighted histograms).
+    """
+
+    if dataA["Class"] != dataB["Class"] or not SameEdges( dataA["Edges"], dataB["Edges"] ):
+        print "Error: Incompatable histograms %s and %s" % (dataA["Name"], dataB["Name"])
+        raise Exception("Incompatable Hists - Binning")
+
+    total = dict( dataA )
+    total["Contents"] = [ a + b for (a, b) in zip( dataA["Contents"], dataB["Contents"] ) ]
+
+    if dataA["Sumw2"] is None and dataB["Sumw2"] is None:
+        total["Sumw2"] = None
+    else:
+        sumw2A = dataA["Sumw2"]
+        if sumw2A is None:
+            sumw2A = dataA["Contents"]
+        sumw2B = dataB["Sumw2"]
+        if sumw2B is None:
+            sumw2B = dataB["Contents"]
+        total["Sumw2"] = [ a + b for (a, b) in zip( sumw2A, sumw2B ) ]
+
+    total["Entries"] = dataA["Entries"] + dataB["Entries"]
+
+    return total
@@ -0,0 +1,127 @@
+
+import os
+import logging
+import hashlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class HistDiskCache():
+    """ A persistent, on-disk cache of histogram data
+
+    Histograms are stored (as the dictionaries made by
+    :py:func:`HistData.HistToData`) in a directory, one
+    file per histogram.  Each entry is keyed by the
+    canonical path, size and modification time of the
+    ROOT file it came from and by the histogram name.
+    If the ROOT file changes, its key changes and the
+    old entry is simply never found again.
+
+    This lets a new process skip reading the same
+    histograms from the same unchanged files.
+    """
+
+    def __init__( self, cacheDir ):
+        self.CacheDir = cacheDir
+        if not os.path.exists( cacheDir ):
+            os.makedirs( cacheDir )
+
+
+    def GetKey( self, file, name ):
+        """ Return the key of a (file, hist) pair
+
+        The key is a tuple of (path, size, mtime, name),
+        or None if the file can't be found
+        """
+        try:
+            path = os.path.realpath( file )
+            stat = os.stat( path )
+        except OSError:
+            return None
+        return (path, stat.st_size, stat.st_mtime, name)
+
+
+    def GetPath( self, key ):
+        """ Return the cache file holding a given key
+
+        """
+        digest = hashlib.sha1( repr(key) ).hexdigest()
+        return os.path.join( self.CacheDir, digest[ : 2 ], digest + ".pkl" )
+
+
+    def Get( self, file, name ):
+        """ Return the stored data for a histogram, or None
+
+        """
+        key = self.GetKey( file, name )
+        if key == None:
+            return None
+
+        path = self.GetPath( key )
+        if not os.path.exists( path ):
+            return None
+
+        try:
+            input = open( path, "rb" )
+            (storedKey, data) = pickle.load( input )
+            input.close()
+        except Exception, e:
+            logging.warning( "HistDiskCache - Removing unreadable cache entry %s (%s)" % (path, e) )
+            os.remove( path )
+            return None
+
+        if storedKey != key:
+            return None
+
+        return data
+
+
+    def Has( self, file, name ):
+        """ Return whether a histogram seems to be stored
+
+        Only checks that its entry exists, without reading it
+        """
+        key = self.GetKey( file, name )
+        return key != None and os.path.exists( self.GetPath( key ) )
+
+
+    def Put( self, file, name, data ):
+        """ Store the data of a histogram
+
+        The entry is written to a temporary file
+        and then renamed, so that a reader in another
+        process never sees a half-written entry.
+        """
+        if data == None:
+            return
+
+        key = self.GetKey( file, name )
+        if key == None:
+            return
+
+        path = self.GetPath( key )
+        dir = os.path.dirname( path )
+        if not os.path.exists( dir ):
+            try:
+                os.makedirs( dir )
+            except OSError:
+                pass # Made by another process
+
+        tmpPath = "%s.%s.tmp" % (path, os.getpid())
+        output = open( tmpPath, "wb" )
+        pickle.dump( (key, data), output, pickle.HIGHEST_PROTOCOL )
+        output.close()
+        os.rename( tmpPath, path )
+
+
+    def Clear( self ):
+        """ Remove every entry in the cache
+
+        """
+        for (dirpath, dirnames, filenames) in os.walk( self.CacheDir ):
+            for filename in filenames:
+                if filename.endswith( ".pkl" ):
+                    os.remove( os.path.join( dirpath, filename ) )
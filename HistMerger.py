@@ -0,0 +1,188 @@
+
+import os
+import logging
+import hashlib
+import multiprocessing
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from HistData import AddHistData
+from HistReaders import ROOTReader
+
+
+class HistMerger():
+    """ Merge a histogram over many files using worker processes
+
+    Like hadd, the list of files is split into chunks
+    of 'chunkSize' files.  A pool of 'nWorkers' processes
+    each read the files of a chunk and sum them.  The
+    partial sums are then added pairwise, again by
+    the workers, until one histogram remains.  The merge
+    time then scales with the number of cores rather
+    than the number of files.
+
+    If a 'partialDir' is given, the partial sum of each
+    chunk is kept there and reused for as long as none
+    of the chunk's files change.  With a 'diskCache'
+    (see :py:class:`HistDiskCache.HistDiskCache`), the
+    workers look there before reading a file, and store
+    what they read.
+
+    The pool of workers is started by the first merge
+    and kept until :py:meth:`~HistMerger.HistMerger.Close`.
+
+    Histograms are passed around as the dictionaries
+    made by :py:func:`HistData.HistToData`.  The
+    files are read by 'reader' (see :py:mod:`HistReaders`)
+    """
+
+    def __init__( self, nWorkers, chunkSize=50, partialDir=None, reader=None, diskCache=None ):
+        if reader == None:
+            reader = ROOTReader()
+        self.Reader = reader
+        self.NumWorkers = nWorkers
+        self.ChunkSize = max( 1, chunkSize )
+        self.PartialDir = partialDir
+        self.DiskCache = diskCache
+        if partialDir != None and not os.path.exists( partialDir ):
+            os.makedirs( partialDir )
+        self.Pool = None
+
+
+    def GetPool( self ):
+        """ Return the pool of workers, starting it if needed
+
+        """
+        if self.Pool == None:
+            self.Pool = multiprocessing.Pool( processes=self.NumWorkers )
+        return self.Pool
+
+
+    def Close( self ):
+        """ Stop the pool of workers
+
+        """
+        if self.Pool == None:
+            return
+        self.Pool.close()
+        self.Pool.join()
+        self.Pool = None
+
+
+    def Terminate( self ):
+        """ Stop the pool of workers straight away
+
+        """
+        if self.Pool == None:
+            return
+        self.Pool.terminate()
+        self.Pool.join()
+        self.Pool = None
+
+
+    def Merge( self, files, name ):
+        """ Return the data of histogram 'name' summed over 'files'
+
+        Return None if the histogram can't be merged
+        this way (eg its class isn't supported by
+        :py:func:`HistData.HistToData`)
+        """
+
+        chunks = [ (self.Reader, files[ i : i+self.ChunkSize ], name, self.PartialDir, self.DiskCache)
+                   for i in range( 0, len(files), self.ChunkSize ) ]
+
+        logging.debug( "HistMerger - \t Merging %s over %s files in %s chunks with %s workers"
+                       % (name, len(files), len(chunks), self.NumWorkers) )
+
+        pool = self.GetPool()
+        try:
+            partials = pool.map( MergeChunk, chunks )
+
+            # Add the partial sums pairwise
+            # until only one is left
+            while None not in partials and len( partials ) > 1:
+                pairs = zip( partials[0::2], partials[1::2] )
+                leftover = partials[ 2*len(pairs) : ]
+                partials = pool.map( AddHistDataPair, pairs ) + leftover
+
+        except (KeyboardInterrupt, SystemExit):
+            # Errors of the workers are raised here and
+            # leave the pool usable, but not these
+            self.Terminate()
+            raise
+
+        if None in partials:
+            return None
+
+        return partials[0]
+
+
+def GetPartialPath( partialDir, files, name ):
+    """ Return the file holding the partial sum of a chunk
+
+    The path depends on the name of the histogram
+    and the path, size and mtime of every file
+    in the chunk.
+    """
+    fileKeys = []
+    for file in files:
+        path = os.path.realpath( file )
+        stat = os.stat( path )
+        fileKeys.append( (path, stat.st_size, stat.st_mtime) )
+    digest = hashlib.sha1( repr( (name, fileKeys) ) ).hexdigest()
+    return os.path.join( partialDir, digest + ".pkl" )
+
+
+def MergeChunk( chunk ):
+    """ Read a histogram from several files and return the sum
+
+    Takes (reader, files, name, partialDir, diskCache).
+    Meant to be run in a worker process, see
+    :py:class:`HistMerger`
+    """
+
+    (reader, files, name, partialDir, diskCache) = chunk
+
+    partialPath = None
+    if partialDir != None:
+        partialPath = GetPartialPath( partialDir, files, name )
+        if os.path.exists( partialPath ):
+            input = open( partialPath, "rb" )
+            total = pickle.load( input )
+            input.close()
+            return total
+
+    total = None
+    for file in files:
+        data = None
+        if diskCache != None:
+            data = diskCache.Get( file, name )
+        if data == None:
+            data = reader.ReadHistData( file, [name] )[0][1]
+            if data == None:
+                return None
+            if diskCache != None:
+                diskCache.Put( file, name, data )
+        if total == None:
+            total = data
+        else:
+            total = AddHistData( total, data )
+
+    if partialPath != None:
+        tmpPath = "%s.%s.tmp" % (partialPath, os.getpid())
+        output = open( tmpPath, "wb" )
+        pickle.dump( total, output, pickle.HIGHEST_PROTOCOL )
+        output.close()
+        os.rename( tmpPath, partialPath )
+
+    return total
+
+
+def AddHistDataPair( pair ):
+    """ Add a pair of histogram data (for use with Pool.map)
+
+    """
+    return AddHistData( *pair )
@@ -0,0 +1,128 @@
+
+#
+# Backends that read histograms out of ROOT files
+# and return their bin data (see HistData.HistToData)
+#
+# Every reader has a method:
+#   ReadHistData( file, histList )
+# which returns a list of (name, data) pairs, with
+# data None for histograms it can't describe.
+# Readers are sent to worker processes, so they
+# must be picklable (and shouldn't hold open files)
+#
+
+from HistData import HistToData, SupportedClasses
+
+try:
+    import uproot
+    import numpy
+except ImportError:
+    uproot = None
+
+
+class ROOTReader():
+    """ Read histograms using PyROOT
+
+    """
+
+    def ReadHistData( self, file, histList ):
+
+        import ROOT
+
+        ROOT.gROOT.SetBatch( True )
+        tfile = ROOT.TFile( file )
+        if not tfile or tfile.IsZombie():
+            raise IOError( 1, "File '" + file + "' could not be opened" )
+
+        results = []
+        for name in histList:
+            hist = tfile.Get( name )
+            if not hist:
+                raise IOError( 5, "Histogram '" + name + "' not found in file '" + file + "'" )
+            results.append( (name, HistToData( hist )) )
+            hist.Delete()
+            del hist
+
+        tfile.Close()
+        return results
+
+
+class UprootReader():
+    """ Read histograms using uproot, without ROOT
+
+    The bin edges, contents and sums of squared
+    weights are returned as numpy arrays, so they
+    can be used directly without ROOT.  Nothing here
+    imports ROOT: a TH1 is only made from the data
+    if :py:func:`HistData.DataToHist` is called.
+
+    Needs the numpy and uproot (version 3, which
+    supports python 2) packages
+    """
+
+    def __init__( self ):
+        if uproot == None:
+            print "Error: The uproot reader needs the uproot and numpy packages"
+            raise ImportError( "uproot" )
+
+    def ReadHistData( self, file, histList ):
+
+        try:
+            tfile = uproot.open( file )
+        except Exception, e:
+            raise IOError( 1, "File '" + file + "' could not be opened (%s)" % e )
+
+        results = []
+        for name in histList:
+            try:
+                hist = tfile[ name ]
+            except KeyError:
+                raise IOError( 5, "Histogram '" + name + "' not found in file '" + file + "'" )
+            results.append( (name, UprootHistToData( hist )) )
+
+        return results
+
+
+def UprootHistToData( hist ):
+    """ Describe a histogram read by uproot like HistData.HistToData
+
+    Return None if its class isn't supported
+    """
+
+    className = hist._classname
+    if not SupportedClasses.match( className ):
+        return None
+
+    dimension = int( className[2] )
+    axes = [ hist._fXaxis, hist._fYaxis, hist._fZaxis ][ : dimension ]
+    axisLabels = [ hist.xlabels ]
+    if dimension > 1:
+        axisLabels.append( hist.ylabels )
+    if dimension > 2:
+        axisLabels.append( None ) # Not provided by uproot
+
+    edges = []
+    labels = []
+    for (axis, binLabels) in zip( axes, axisLabels ):
+        if len( axis._fXbins ) > 0:
+            edges.append( numpy.asarray( axis._fXbins, dtype="float64" ) )
+        else:
+            edges.append( numpy.linspace( axis._fXmin, axis._fXmax, axis._fNbins+1 ) )
+        if binLabels == None:
+            binLabels = []
+        labels.append( [ (bin+1, label) for (bin, label) in enumerate( binLabels ) if label != "" ] )
+
+    # uproot histograms are arrays of all bins
+    # (including under/overflow) in ROOT's order
+    contents = numpy.array( hist, dtype="float64" )
+
+    sumw2 = None
+    if len( hist._fSumw2 ) > 0:
+        sumw2 = numpy.array( hist._fSumw2, dtype="float64" )
+
+    data = { "Class" : className, "Name" : hist._fName, "Title" : hist._fTitle,
+             "Edges" : edges, "Labels" : labels,
+             "AxisTitles" : [ axis._fTitle for axis in axes ],
+             "Contents" : contents, "Sumw2" : sumw2, "Entries" : hist._fEntries }
+
+    return data
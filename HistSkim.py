@@ -0,0 +1,179 @@
+
+#
+# Skim files: one small ROOT file holding the
+# already-merged histograms of every sample
+# a set of plots needs.
+#
+# Each histogram is stored as:
+#   SampleName/FullHistName
+# where FullHistName includes the sample's prefix.
+# A JSON mapping (stored in the file as a TObjString
+# named "PlotMakerSkim") records, for each sample,
+# its prefix, the histograms stored and a digest
+# of the input files they were merged from.
+#
+
+import os
+import sys
+import json
+import hashlib
+import logging
+
+import ROOT
+
+# Import native OrderedDict, or use
+# local version for python < 2.7
+if sys.version_info >= (2, 7):
+    from collections import OrderedDict
+else:
+    from OrderedDict import *
+
+from HistCollector import HistCollector
+from helpers.tools import GetHist, GetHistName
+
+SkimMappingName = "PlotMakerSkim"
+
+
+def GetFilesDigest( files ):
+    """ Return a digest of the path, size and mtime of a list of files
+
+    The skim of a sample is valid as long
+    as this doesn't change
+    """
+    fileKeys = []
+    for file in files:
+        path = os.path.realpath( file )
+        stat = os.stat( path )
+        fileKeys.append( (path, stat.st_size, stat.st_mtime) )
+    return hashlib.sha1( repr( sorted( fileKeys ) ) ).hexdigest()
+
+
+def GetSkimDir( tfile, path ):
+    """ Return the directory of a path in a file, making it if needed
+
+    """
+    directory = tfile
+    for name in path.split( "/" ):
+        if name == "":
+            continue
+        subdir = directory.GetDirectory( name )
+        if not subdir:
+            subdir = directory.mkdir( name )
+        directory = subdir
+    return directory
+
+
+def WriteSkim( skimFile, plots, histCache=None ):
+    """ Merge the histograms of a list of plots and write them to a skim file
+
+    Each plot (see :py:class:`PlotMaker.PlotMaker`)
+    gives a sample and a histogram.  Every histogram
+    is merged over its sample's files (see
+    :py:func:`helpers.tools.GetHist`) and written
+    only once, unscaled and unstyled.
+    Return the mapping stored in the file.
+    """
+
+    if histCache == None:
+        histCache = HistCollector()
+
+    mapping = OrderedDict()
+    toWrite = OrderedDict()
+
+    for plot in plots:
+
+        # Some plots are given their TH1's directly
+        if not isinstance( plot["Hist"], basestring ):
+            continue
+
+        sampleName = plot["SampleName"]
+        histName = GetHistName( plot )
+
+        if "FileList" not in plot or len( plot["FileList"] ) == 0:
+            plot["FileList"] = histCache.Glob( plot["Files"] )
+        if len( plot["FileList"] ) == 0:
+            print "Error: No files found in glob string: ", plot["Files"]
+            raise Exception("Files")
+
+        inputs = GetFilesDigest( plot["FileList"] )
+
+        if sampleName not in mapping:
+            mapping[ sampleName ] = { "Prefix" : plot.get("Prefix"), "Inputs" : inputs, "Hists" : [] }
+        entry = mapping[ sampleName ]
+
+        if entry["Inputs"] != inputs or entry["Prefix"] != plot.get("Prefix"):
+            print "Error: Sample %s is used with different files or prefixes" % sampleName
+            raise Exception("Skim - Sample")
+
+        if histName not in entry["Hists"]:
+            entry["Hists"].append( histName )
+            toWrite[ (sampleName, histName) ] = plot
+
+    tmpFile = "%s.%s.tmp" % (skimFile, os.getpid())
+    output = ROOT.TFile( tmpFile, "RECREATE" )
+    if not output or output.IsZombie():
+        raise IOError( 1, "File '" + skimFile + "' could not be created" )
+
+    for ((sampleName, histName), plot) in toWrite.iteritems():
+        logging.debug( "WriteSkim: Writing %s of sample %s" % (histName, sampleName) )
+        hist = GetHist( plot, histCache )
+        (dirName, sep, baseName) = ( sampleName + "/" + histName ).rpartition( "/" )
+        directory = GetSkimDir( output, dirName )
+        directory.WriteTObject( hist, baseName )
+        hist.Delete()
+
+    output.WriteTObject( ROOT.TObjString( json.dumps( mapping ) ), SkimMappingName )
+    output.Close()
+    ROOT.gROOT.cd()
+    os.rename( tmpFile, skimFile )
+
+    print "Wrote %s histograms of %s samples to %s" % (len(toWrite), len(mapping), skimFile)
+
+    return mapping
+
+
+def ReadSkimMapping( skimFile ):
+    """ Return the mapping stored in a skim file
+
+    """
+    tfile = ROOT.TFile( skimFile )
+    if not tfile or tfile.IsZombie():
+        raise IOError( 1, "File '" + skimFile + "' could not be opened" )
+    stored = tfile.Get( SkimMappingName )
+    if not stored:
+        tfile.Close()
+        print "Error: %s is not a skim file" % skimFile
+        raise Exception("Skim - Mapping")
+    mapping = json.loads( str( stored.GetString() ) )
+    tfile.Close()
+    ROOT.gROOT.cd()
+    return mapping
+
+
+def UseSkimForSample( skimFile, mapping, sample ):
+    """ Return a sample reading its histograms from a skim file
+
+    The returned sample's FileList is the skim file and
+    its prefix points into the sample's directory.
+    Return None if the skim doesn't hold the sample,
+    or was made from other files or with another prefix.
+    """
+
+    name = sample["Name"]
+    if name not in mapping:
+        return None
+
+    entry = mapping[ name ]
+    if entry["Prefix"] != sample.get("Prefix"):
+        logging.warning( "UseSkim: Prefix of sample %s changed, not using %s" % (name, skimFile) )
+        return None
+
+    if len( sample["FileList"] ) == 0 or GetFilesDigest( sample["FileList"] ) != entry["Inputs"]:
+        logging.warning( "UseSkim: Files of sample %s changed, not using %s" % (name, skimFile) )
+        return None
+
+    prefix = sample.get("Prefix")
+    if prefix == None:
+        prefix = ""
+
+    return sample.Replace( Prefix=name + "/" + prefix, FileList=[ skimFile ], SkimFile=skimFile )
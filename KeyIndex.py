@@ -0,0 +1,246 @@
+
+import os
+import json
+import logging
+import difflib
+import hashlib
+
+
+class KeyIndex():
+    """ An index of the keys in ROOT files
+
+    For each file, walk its TDirectory tree once
+    (reading only the keys, never the objects they
+    point to) and record the path, class name, cycle,
+    on-disk size and position of every object.
+
+    If a 'cacheDir' is given, the index of each file
+    is stored there (in cacheDir/index) and reused as
+    long as the file's size and modification time
+    don't change.  This answers "what is in this file"
+    without opening it again.
+
+    Each index is an ordered list of entries:
+    { "Path", "Class", "Cycle", "Bytes", "ObjLen", "Seek", "IsHist", "IsDir" }
+    in the order the keys appear in the file.
+    """
+
+    def __init__( self, cacheDir=None ):
+        self.Indices = {}
+        self.IndexDir = None
+        self.SetCacheDir( cacheDir )
+
+
+    def SetCacheDir( self, cacheDir ):
+        """ Set the directory in which to store the indices
+
+        None keeps them in memory only
+        """
+        if cacheDir == None:
+            self.IndexDir = None
+            return
+        self.IndexDir = os.path.join( cacheDir, "index" )
+        if not os.path.exists( self.IndexDir ):
+            os.makedirs( self.IndexDir )
+
+
+    def GetFileKey( self, file ):
+        """ Return the (path, size, mtime) of a file
+
+        An index is only valid while this doesn't change
+        """
+        path = os.path.realpath( file )
+        stat = os.stat( path )
+        return [ path, stat.st_size, stat.st_mtime ]
+
+
+    def GetIndexPath( self, fileKey ):
+        """ Return the path of the stored index of a file
+
+        """
+        digest = hashlib.sha1( fileKey[0] ).hexdigest()
+        return os.path.join( self.IndexDir, digest + ".json" )
+
+
+    def GetKeys( self, file, openFile=None ):
+        """ Return the index (a list of key entries) of a file
+
+        Use the index in memory or on disk if it is still
+        valid.  Otherwise open the file (using 'openFile',
+        a function taking the file name and returning an
+        open TFile, if given) and walk its keys.
+        """
+
+        fileKey = self.GetFileKey( file )
+
+        if file in self.Indices:
+            (storedKey, keys, entries) = self.Indices[ file ]
+            if storedKey == fileKey:
+                return keys
+
+        keys = None
+        if self.IndexDir != None:
+            keys = self.LoadIndex( fileKey )
+
+        if keys == None:
+            logging.debug( "KeyIndex - \t Indexing file: %s" % file )
+            if openFile != None:
+                tfile = openFile( file )
+                keys = WalkKeys( tfile )
+            else:
+                import ROOT
+                tfile = ROOT.TFile( file )
+                if not tfile or tfile.IsZombie():
+                    raise IOError( 1, "File '" + file + "' could not be opened" )
+                keys = WalkKeys( tfile )
+                tfile.Close()
+            if self.IndexDir != None:
+                self.SaveIndex( fileKey, keys )
+
+        entries = dict( [ (entry["Path"], entry) for entry in keys ] )
+        self.Indices[ file ] = (fileKey, keys, entries)
+        return keys
+
+
+    def LoadIndex( self, fileKey ):
+        """ Load the stored index of a file, or return None
+
+        """
+        path = self.GetIndexPath( fileKey )
+        if not os.path.exists( path ):
+            return None
+        try:
+            input = open( path )
+            stored = json.load( input )
+            input.close()
+        except Exception, e:
+            logging.warning( "KeyIndex - Ignoring unreadable index %s (%s)" % (path, e) )
+            return None
+        if stored.get( "File" ) != fileKey:
+            return None
+        return stored[ "Keys" ]
+
+
+    def SaveIndex( self, fileKey, keys ):
+        """ Store the index of a file
+
+        """
+        path = self.GetIndexPath( fileKey )
+        tmpPath = "%s.%s.tmp" % (path, os.getpid())
+        output = open( tmpPath, "w" )
+        json.dump( { "File" : fileKey, "Keys" : keys }, output )
+        output.close()
+        os.rename( tmpPath, path )
+
+
+    def GetEntry( self, file, name, openFile=None ):
+        """ Return the index entry of an object, or None
+
+        """
+        self.GetKeys( file, openFile )
+        (fileKey, keys, entries) = self.Indices[ file ]
+        return entries.get( name )
+
+
+    def GetStoredKeys( self, file ):
+        """ Return the index of a file if it is already indexed, or None
+
+        Use the index in memory or on disk if it is
+        still valid, but never open the file to index it
+        """
+        fileKey = self.GetFileKey( file )
+
+        if file in self.Indices:
+            (storedKey, keys, entries) = self.Indices[ file ]
+            if storedKey == fileKey:
+                return keys
+
+        if self.IndexDir == None:
+            return None
+        keys = self.LoadIndex( fileKey )
+        if keys == None:
+            return None
+
+        entries = dict( [ (entry["Path"], entry) for entry in keys ] )
+        self.Indices[ file ] = (fileKey, keys, entries)
+        return keys
+
+
+    def GetIndexedEntry( self, file, name ):
+        """ Return the entry of an object if its file is already indexed
+
+        Never opens or indexes the file: return
+        None if its index isn't in memory
+        """
+        if file not in self.Indices:
+            return None
+        (fileKey, keys, entries) = self.Indices[ file ]
+        return entries.get( name )
+
+
+    def HasKey( self, file, name, openFile=None ):
+        """ Return whether the file holds an object of the given path
+
+        """
+        return self.GetEntry( file, name, openFile ) != None
+
+
+    def ListHists( self, file, openFile=None ):
+        """ Return the paths of all histograms in the file
+
+        """
+        return [ entry["Path"] for entry in self.GetKeys( file, openFile ) if entry["IsHist"] ]
+
+
+    def FindSimilar( self, file, name, openFile=None ):
+        """ Return the histogram paths in the file most like 'name'
+
+        Useful to suggest what was meant in error messages
+        """
+        return difflib.get_close_matches( name, self.ListHists( file, openFile ) )
+
+
+def WalkKeys( directory, prefix="" ):
+    """ Return the entries of all keys below a directory
+
+    Only the keys are read: objects themselves are never
+    read, except sub-directories (whose headers are
+    needed to list their keys).  If an object has
+    several cycles, only the highest one is listed.
+    """
+
+    import ROOT
+
+    keys = []
+    seen = {}
+
+    for key in directory.GetListOfKeys():
+
+        path = prefix + key.GetName()
+        className = key.GetClassName()
+
+        if path in seen:
+            entry = seen[ path ]
+            if key.GetCycle() <= entry["Cycle"]:
+                continue
+        else:
+            entry = { "Path" : path }
+            seen[ path ] = entry
+            keys.append( entry )
+
+        keyClass = ROOT.TClass.GetClass( className )
+        entry["Class"]  = className
+        entry["Cycle"]  = key.GetCycle()
+        entry["Bytes"]  = key.GetNbytes()
+        entry["ObjLen"] = key.GetObjlen()
+        entry["Seek"]   = key.GetSeekKey()
+        entry["IsHist"] = bool( keyClass and keyClass.InheritsFrom( "TH1" ) )
+        entry["IsDir"]  = bool( keyClass and keyClass.InheritsFrom( "TDirectory" ) )
+
+    for entry in list( keys ):
+        if entry["IsDir"]:
+            subdir = directory.GetDirectory( entry["Path"][ len(prefix) : ] )
+            if subdir:
+                keys.extend( WalkKeys( subdir, entry["Path"] + "/" ) )
+
+    return keys
@@ -0,0 +1,136 @@
+
+import os
+import json
+import logging
+
+
+class PlotBook():
+    """ Multi-page PDF files collecting many plots
+
+    Rather than saving each plot to its own file,
+    every canvas is added as a page (titled by its
+    OutputName) of a 'volume':
+
+    book_001.pdf, book_002.pdf, ...
+
+    for a book named 'book.pdf'.  A new volume is
+    started once the current one has 'maxPages'
+    pages or (approximately) 'maxBytes' bytes.
+    None means no limit.
+
+    A table of contents, listing the volume and page
+    of each OutputName, is written to book.toc.json
+    when the book is closed.
+
+    See :py:meth:`PlotMaker.PlotMaker.IterGeneratePlotsInCache`
+    """
+
+    def __init__( self, fileName, maxPages=500, maxBytes=None ):
+        if fileName.endswith( ".pdf" ):
+            fileName = fileName[ : -len(".pdf") ]
+        self.Base = fileName
+        self.MaxPages = maxPages
+        self.MaxBytes = maxBytes
+
+        self.Volumes = []
+        self.Contents = []
+        self.Pages = {}
+
+        # The open volume, its number of pages
+        # and the canvas last printed to it
+        self.Current = None
+        self.CurrentPages = 0
+        self.Canvas = None
+
+
+    def GetVolumeName( self, number ):
+        """ Return the file name of a volume (counting from 1)
+
+        """
+        return "%s_%03d.pdf" % (self.Base, number)
+
+
+    def GetTOCName( self ):
+        """ Return the file name of the table of contents
+
+        """
+        return "%s.toc.json" % self.Base
+
+
+    def IsFull( self ):
+        """ Return whether the open volume has reached its limits
+
+        """
+        if self.MaxPages != None and self.CurrentPages >= self.MaxPages:
+            return True
+        if self.MaxBytes != None and os.path.exists( self.Current ) \
+                and os.path.getsize( self.Current ) >= self.MaxBytes:
+            return True
+        return False
+
+
+    def AddPage( self, canvas, outputName ):
+        """ Print a canvas as the next page of the book
+
+        Return the (volume, page) it went to
+        """
+
+        if self.Current != None and self.IsFull():
+            self.CloseVolume()
+
+        if self.Current == None:
+            self.Current = self.GetVolumeName( len( self.Volumes ) + 1 )
+            self.CurrentPages = 0
+            self.Volumes.append( self.Current )
+            logging.debug( "PlotBook - \t Opening volume: %s" % self.Current )
+            canvas.Print( self.Current + "[" )
+
+        canvas.Print( self.Current, "Title:" + outputName )
+        self.Canvas = canvas
+        self.CurrentPages += 1
+
+        entry = { "OutputName" : outputName, "File" : self.Current,
+                  "Page" : self.CurrentPages, "BookPage" : len( self.Contents ) + 1 }
+        self.Contents.append( entry )
+        self.Pages[ outputName ] = entry
+
+        return (self.Current, self.CurrentPages)
+
+
+    def GetEntry( self, outputName ):
+        """ Return the contents entry of an OutputName, or None
+
+        """
+        return self.Pages.get( outputName )
+
+
+    def CloseVolume( self ):
+        """ Close the open volume
+
+        """
+        self.Canvas.Print( self.Current + "]" )
+        if not os.path.exists( self.Current ):
+            print "Error -  Failed to make the following output: %s" % self.Current
+            raise Exception("PlotBook - Volume")
+        logging.debug( "PlotBook - \t Closed volume: %s (%s pages)" % (self.Current, self.CurrentPages) )
+        self.Current = None
+        self.CurrentPages = 0
+
+
+    def Close( self ):
+        """ Close the open volume and write the table of contents
+
+        """
+        if self.Current != None:
+            self.CloseVolume()
+        self.Canvas = None
+
+        tocName = self.GetTOCName()
+        tmpName = "%s.%s.tmp" % (tocName, os.getpid())
+        output = open( tmpName, "w" )
+        json.dump( { "Volumes" : self.Volumes, "Contents" : self.Contents }, output, indent=1 )
+        output.close()
+        os.rename( tmpName, tocName )
+
+        print "Wrote %s pages to %s volumes (contents in %s)" \
+            % (len( self.Contents ), len( self.Volumes ), tocName)
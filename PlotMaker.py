@@ -8,11 +8,20 @@
 # My git Test
 
 import sys
+import os
 import glob
 import logging #log
 import copy
 import itertools
 import random
+import time
+import json
+import traceback
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 # Import native OrderedDict, or use
 # local version for python < 2.7
@@ -32,6 +41,10 @@ from helpers.MakeLatexTable import *
 
 import ROOT
 from HistCollector import *
+from HistSkim import WriteSkim, ReadSkimMapping, UseSkimForSample
+from RequestPlan import RequestPlan
+from Samples import Sample, PlotEntry, ToJSON
+from PlotBook import PlotBook
 
 
 class PlotMaker( ROOT.TNamed ):
@@ -141,6 +154,7 @@ class PlotMaker( ROOT.TNamed ):
         self.__newBins = None
 
         self.__outputDir = ""
+        self.__numWorkers = 1
 
         self.__defaultcolors     = [30,33,38,46,41,40,14,21,29,34,47,49,9,43,23,45]+[34,46,43,30,31,44,42,47,29,45,33,36,35,27,32,41,39,38,26,37,48,40]+[4,3,2,6,38,33,20,7,8] 
         self.__defaultlinestyles = [4,3,2,5,6,40,41,46,38,33,30,20,7,8,9] # bright colors
@@ -207,6 +221,63 @@ class PlotMaker( ROOT.TNamed ):
 
     def SetOutputDir( self, outputDir ) :
         self.__outputDir = outputDir
+
+    def SetMaxOpenFiles( self, maxOpenFiles ):
+        """ Set the number of input files kept open
+
+        Input files are kept open between histogram
+        lookups.  Once more than this many are open,
+        the least recently used one is closed.
+        """
+        self.histCache.SetMaxOpenFiles( maxOpenFiles )
+
+    def SetMaxCacheBytes( self, maxCacheBytes ):
+        """ Set the memory budget of the histogram cache
+
+        Once the cached histograms take more than
+        (approximately) this many bytes, the least
+        recently used ones are evicted.
+        None means no limit.
+        """
+        self.histCache.SetMaxCacheBytes( maxCacheBytes )
+
+    def SetNumWorkers( self, numWorkers ):
+        """ Set the number of processes used to read input files
+
+        With more than one worker, the histograms needed
+        by cached requests are read by a pool of processes
+        (see :py:meth:`~PlotMaker.PlotMaker.FillCachedHistograms`)
+        """
+        self.__numWorkers = numWorkers
+
+    def SetParallelMerge( self, numWorkers, minFiles=100, chunkSize=50, partialDir=None ):
+        """ Merge samples with many files using several processes
+
+        Samples with at least 'minFiles' files are merged
+        in chunks of 'chunkSize' files by 'numWorkers'
+        processes.  If a 'partialDir' is given, the merged
+        chunks are kept there and reused by later runs.
+        """
+        self.histCache.SetParallelMerge( numWorkers, minFiles, chunkSize, partialDir )
+
+    def SetReader( self, reader ):
+        """ Set the backend used to read input files
+
+        For example, HistReaders.UprootReader() reads
+        files without ROOT.  See :py:mod:`HistReaders`
+        """
+        self.histCache.SetReader( reader )
+
+    def SetCacheDir( self, cacheDir ):
+        """ Set a directory to persistently cache histograms in
+
+        Histograms read from input files are stored
+        there and reused by later runs, as long as
+        the input files don't change.  So are the
+        files matched by the samples' glob patterns,
+        so set this before adding samples.
+        """
+        self.histCache.SetCacheDir( cacheDir )
     
     def GetConfigurationState(self):
         """ Return a dictionary of the config state
@@ -284,24 +355,22 @@ class PlotMaker( ROOT.TNamed ):
 
         Supply it a name and a file (or list of files using '*')
         """
-        for file in glob.glob(files):
-            self.logger.info( "AddDataFile: Adding data file: " + file )
-
         # Glob the files
-        FileList = glob.glob( files )
+        FileList = self.histCache.Glob( files )
+
+        for file in FileList:
+            self.logger.info( "AddDataFile: Adding data file: " + file )
 
         if title==None:
             title=name
 
-        # Create the dictionary
-        info = { "Name" : name, "Files" : files, "Title" : title, "Prefix" : prefix, 
-                 "FileList" : FileList, "Type" : "DATA", "ScaleByLumi" : False }
-
+        # Create the sample
         if name not in self.__datasamples:
-            self.__datasamples[name] = info
+            self.__datasamples[name] = Sample( Name=name, Files=files, Title=title, Prefix=prefix,
+                                               FileList=FileList, Type="DATA", ScaleByLumi=False )
         else:
-            self.__datasamples[name]["FileList"].extend( FileList )
-        pass
+            sample = self.__datasamples[name]
+            self.__datasamples[name] = sample.Replace( FileList=sample["FileList"] + tuple( FileList ) )
 
         return
 
@@ -315,7 +384,10 @@ class PlotMaker( ROOT.TNamed ):
         Optionally supply a color and a linestyle
         """
 
-        for file in glob.glob(files):
+        # Glob the files
+        FileList = self.histCache.Glob( files )
+
+        for file in FileList:
             self.logger.info( "AddMCFile:  Adding Monte Carlo file: " + file + " (" + name + ")" )
 
         # Pick a random color if none supplied
@@ -326,23 +398,19 @@ class PlotMaker( ROOT.TNamed ):
 
         if title==None:
             title=name
-        
-        # Glob the files
-        FileList = glob.glob( files )
 
         # Check if this sample has already been added:
         if name in self.__mcsamples:
             sample = self.__mcsamples[name]
-            sample["FileList"].extend( FileList )
+            self.__mcsamples[name] = sample.Replace( FileList=sample["FileList"] + tuple( FileList ) )
 
         # Otherwise, create the sample
         else:
-            info = { "Name" : name, "Files" : files, "FileList" : FileList, 
-                     "Title" : title, "Prefix" : prefix,
-                     "Scale" : Scale, "Color" : color, 
-                     "LineStyle" : linestyle, "Signal" : signal, "Type" : "MC",
-                     "ScaleByLumi" : ScaleByLumi }
-            self.__mcsamples[name] = info
+            self.__mcsamples[name] = Sample( Name=name, Files=files, FileList=FileList,
+                                             Title=title, Prefix=prefix,
+                                             Scale=Scale, Color=color,
+                                             LineStyle=linestyle, Signal=signal, Type="MC",
+                                             ScaleByLumi=ScaleByLumi )
 
         return
 
@@ -367,23 +435,75 @@ class PlotMaker( ROOT.TNamed ):
             title=name
 
         # Glob the files
-        FileList = glob.glob( files )
+        FileList = self.histCache.Glob( files )
 
         # Check if this sample has already been added:
         if name in self.__bsmsamples:
             sample = self.__bsmsamples[name]
-            sample["FileList"].extend( FileList )
+            self.__bsmsamples[name] = sample.Replace( FileList=sample["FileList"] + tuple( FileList ) )
 
         # Otherwise, create the sample
         else:
-            info = { "Name" : name, "Files" : files, "FileList" : FileList, 
-                     "Prefix" : prefix, "Scale" : Scale, "ScaleByLumi" : True,
-                     "Title" : title, "Color" : color, "LineStyle" : linestyle, "Type" : "BSM" }
-            self.__bsmsamples[name] = info
+            self.__bsmsamples[name] = Sample( Name=name, Files=files, FileList=FileList,
+                                              Prefix=prefix, Scale=Scale, ScaleByLumi=True,
+                                              Title=title, Color=color, LineStyle=linestyle, Type="BSM" )
 
         return
 
 
+    def WriteSkim( self, skimFile, histList=None, sampleList=None ):
+        """ Write the merged histograms the plots need to one skim file
+
+        By default, every histogram of every sample
+        in the request cache is written.  Otherwise,
+        each histogram in 'histList' is written for
+        each sample in 'sampleList' (or all samples).
+        Reading them back with
+        :py:meth:`~PlotMaker.PlotMaker.UseSkim` then only
+        needs this one small file.  See :py:mod:`HistSkim`
+        """
+
+        if histList == None:
+            plots = [ plot for request in self.requestCache for plot in request["Plots"] ]
+        else:
+            if sampleList == None:
+                sampleList = self.__datasamples.keys() + self.__mcsamples.keys() + self.__bsmsamples.keys()
+            plots = []
+            for sampleName in sampleList:
+                for hist in histList:
+                    plot = self.GetPlot( sampleName )
+                    plot["Hist"] = hist
+                    plots.append( plot )
+
+        return WriteSkim( skimFile, plots, self.histCache )
+
+
+    def UseSkim( self, skimFile ):
+        """ Read samples' histograms from a skim file
+
+        Every sample stored in the skim file
+        (see :py:meth:`~PlotMaker.PlotMaker.WriteSkim`)
+        reads from it instead of its own files, as long
+        as those files haven't changed since.
+        Call this after adding the samples and
+        before making any plots.
+        """
+
+        mapping = ReadSkimMapping( skimFile )
+
+        used = []
+        for samples in [ self.__datasamples, self.__mcsamples, self.__bsmsamples ]:
+            for (name, sample) in samples.items():
+                skimmed = UseSkimForSample( skimFile, mapping, sample )
+                if skimmed != None:
+                    samples[ name ] = skimmed
+                    used.append( name )
+
+        self.logger.info( "UseSkim: Reading samples %s from %s" % (", ".join( used ), skimFile) )
+
+        return used
+
+
     def PrintAllSamples(self):
         """ Print all samples
 
@@ -407,8 +527,9 @@ class PlotMaker( ROOT.TNamed ):
 
         print "BSM Samples:"
         for name, sample in self.__bsmsamples.iteritems():
-            for key, val in sample:
-                print key, val
+            for (key, val) in sample.iteritems():
+                print " %s : %s " % (key, val),
+            print "\n"
         print ""
 
 
@@ -423,6 +544,57 @@ class PlotMaker( ROOT.TNamed ):
         return
 
 
+    def ExportRequests( self, fileName ):
+        """ Write the request cache to a JSON file
+
+        Each request already holds its samples (with their
+        file lists) and the configuration state, so the
+        file can be run elsewhere with
+        :py:meth:`~PlotMaker.PlotMaker.ImportRequests`
+        (see runShard.py).  Requests holding their own
+        TH1's can't be written and are left out.
+        """
+
+        requests = []
+        for request in self.requestCache:
+            if not CanRenderInWorker( request ):
+                self.logger.warning( "ExportRequests: Leaving out %s (it holds TH1's)" % request.get("OutputName") )
+                continue
+            for plot in request["Plots"]:
+                if not plot.get("FileList"):
+                    plot["FileList"] = self.histCache.Glob( plot["Files"] )
+            requests.append( request )
+
+        tmpName = "%s.%s.tmp" % (fileName, os.getpid())
+        output = open( tmpName, "w" )
+        json.dump( { "Requests" : requests }, output, indent=1, default=ToJSON )
+        output.close()
+        os.rename( tmpName, fileName )
+
+        print "Wrote %s requests to %s" % (len(requests), fileName)
+
+
+    def ImportRequests( self, fileName, shard=None, numShards=None ):
+        """ Add the requests of a JSON file to the request cache
+
+        The file is made by :py:meth:`~PlotMaker.PlotMaker.ExportRequests`.
+        If a 'shard' (from 0 to 'numShards'-1) is given,
+        only add that shard's requests (see :py:func:`GetShard`).
+        Return the number of requests added.
+        """
+
+        input = open( fileName )
+        requests = EncodeStrings( json.load( input )["Requests"] )
+        input.close()
+
+        if shard != None:
+            requests = GetShard( requests, shard, numShards )
+
+        self.requestCache.extend( requests )
+
+        return len( requests )
+
+
     def GetNotUsedColor( self ):
         """ Get a color if one isn't already supplied
 
@@ -448,19 +620,22 @@ class PlotMaker( ROOT.TNamed ):
 
 
     def GetPlot( self, sampleName ) :
-        """ Find a stored sample and return a deepcopy
+        """ Find a stored sample and return a plot of it
 
+        The plot (see :py:class:`Samples.PlotEntry`) shares
+        the sample and its file list: setting a key
+        only changes the plot.
         """
         plot = None
 
         if sampleName in self.__mcsamples:
-            plot = copy.deepcopy( self.__mcsamples[ sampleName ] )
+            plot = PlotEntry( self.__mcsamples[ sampleName ] )
 
         elif sampleName in self.__bsmsamples:
-            plot = copy.deepcopy( self.__bsmsamples[ sampleName ] )
+            plot = PlotEntry( self.__bsmsamples[ sampleName ] )
 
         elif sampleName in self.__datasamples:
-            plot = copy.deepcopy( self.__datasamples[ sampleName ] )
+            plot = PlotEntry( self.__datasamples[ sampleName ] )
 
         else:
             print "Error: Sample %s not found in either MC or data" % sampleName
@@ -579,7 +754,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            return MakeMultiplePlot( outputName, request );
+            return MakeMultiplePlot( outputName, request, self.histCache );
 
 
     def MakeEfficiencyPlot( self, numerator, denominator, sampleName, outputName="", cache=False, **kwargs):
@@ -631,7 +806,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            MakeQuotientPlot( outputName, request );
+            MakeQuotientPlot( outputName, request, self.histCache );
 
         return
 
@@ -703,9 +878,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            MakeMCDataStack( outputName, request );
-
-        ROOT.gROOT.DeleteAll()
+            MakeMCDataStack( outputName, request, self.histCache );
 
         return
 
@@ -761,9 +934,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            MakeDataPlot( outputName, request );
-
-        ROOT.gROOT.DeleteAll()
+            MakeDataPlot( outputName, request, self.histCache );
 
         return
 
@@ -816,7 +987,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            MakeStack( outputName, request );
+            MakeStack( outputName, request, self.histCache );
 
         return
 
@@ -867,7 +1038,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            MakeMCStack( outputName, request );
+            MakeMCStack( outputName, request, self.histCache );
 
         return
 
@@ -904,7 +1075,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            MakeMultiplePlot( outputName, request );
+            MakeMultiplePlot( outputName, request, self.histCache );
 
         return
 
@@ -969,7 +1140,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            return MakeMultiplePlot( outputName, request );
+            return MakeMultiplePlot( outputName, request, self.histCache );
 
         return
 
@@ -989,7 +1160,7 @@ class PlotMaker( ROOT.TNamed ):
         plot = self.GetPlot( sampleName ) #copy.deepcopy( self.GetPlot( sampleName ) )
         plot.update( plotOptions )
         plot["Hist"] = hist
-        th1 = GetAndStyleHist( plot, self.histCache )
+        th1 = GetAndStyleHist( plot, self.histCache, request.get("LazyHists") )
         ScaleHist( th1, plot, request )
         return th1
 
@@ -1049,7 +1220,7 @@ class PlotMaker( ROOT.TNamed ):
         if cache:
             self.requestCache.append( request )
         else:
-            MakeMultipleTH1Plot( outputName, request );
+            MakeMultipleTH1Plot( outputName, request, self.histCache );
 
         return
 
@@ -1089,7 +1260,7 @@ class PlotMaker( ROOT.TNamed ):
 
         # Get a list of all plots
         # (We should have only one)
-        histList = GetNameHistList( request ) # hist = GetAndStyleHist( plot )
+        histList = GetNameHistList( request, self.histCache ) # hist = GetAndStyleHist( plot )
         
         (name, hist) = histList[0]
 
@@ -1182,7 +1353,7 @@ class PlotMaker( ROOT.TNamed ):
                     if name not in sampleList:
                         continue
                     pass
-                plot = copy.deepcopy(sample)
+                plot = PlotEntry( sample )
                 plot.update( plotOptions )
                 plot["Hist"] = channel
                 request["Plots"].append( plot )
@@ -1399,7 +1570,7 @@ class PlotMaker( ROOT.TNamed ):
 
         # Create the plot requests for the samples
         for sample in samples_to_use:
-            plot = copy.deepcopy(sample)
+            plot = PlotEntry( sample )
             plot["Hist"] = channelHistName
             plot.update( plotOptions )
             request["Plots"].append( plot )
@@ -1663,115 +1834,656 @@ class PlotMaker( ROOT.TNamed ):
         of plot associated with a request and, based on that, 
         passes the request to the proper function.
 
-        All possible functions must be hard-coded here.
-        This makes it easy for the cache to work, since 
+        All possible functions must be hard-coded (in
+        :py:func:`DrawRequest`, which worker processes
+        also use).  This makes it easy for the cache to work, since 
         to generate plots from cached requests, one need
         only loop over the cache and pass each request through
         this function.
 
         """
 
-        plotType   = request["Type"]
-        outputName = request["OutputName"]
+        DrawRequest( request, self.histCache )
+
+
+    def FillCachedHistograms( self, numWorkers=None ):
+        """ Cache all histograms in the request cache
+
+        This is the real advantage of the cache:
+        - Loop through all requests in the request cache
+        - Get the names and files of all histograms that will be needed
+        - Sort each file's histograms by their position in the file
+        - Loop over each file and cache all the necessary histograms
+
+        The idea is that each file needs to only be opened once, which
+        saves a lot of time in I/O
+
+        If numWorkers (by default, the value given to
+        :py:meth:`~PlotMaker.PlotMaker.SetNumWorkers`) is more
+        than 1, the files are read by that many processes in parallel
+        """
+
+        if numWorkers == None:
+            numWorkers = self.__numWorkers
+
+        # Get the full name of every histogram
+        # (as GetHist will ask for it), once per
+        # file, in the order they're stored
+        FileHistMap = self.histCache.GetReadPlan( GetFileHistMap( self.requestCache, self.histCache ) )
+
+        # Now that we have the list, 
+        # Let's cache all histograms
+        if numWorkers > 1:
+            self.histCache.CacheHistsParallel( FileHistMap, numWorkers )
+        else:
+            for file, histlist in FileHistMap.iteritems():
+                self.histCache.CacheHists( file, histlist )
+
+        print "Successfully cached all histograms"
+    
+
+    def ClearHistCache( self ):
+        """ Clear the histogram Cache """
+        self.histCache.ClearCache()
+        self.histCache.CloseAllFiles()
+
+
+    def ValidateRequests( self ):
+        """ Check that every cached request can find its histograms
+
+        Before anything is drawn, look up every (file,
+        histogram) pair the request cache needs in the
+        files' key indices.  Report all that are
+        missing at once, rather than failing at the
+        first one, part way through the plots.
+        """
+
+        problems = []
+
+        for request in self.requestCache:
+            for plot in request["Plots"]:
+                if not isinstance( plot["Hist"], basestring ):
+                    continue
+                if not plot.get("FileList") and len( self.histCache.Glob( plot["Files"] ) ) == 0:
+                    problems.append( "No files found in glob string: %s" % plot["Files"] )
+
+        fileHistMap = GetFileHistMap( self.requestCache, self.histCache )
+        for (file, name, message) in self.histCache.FindMissingHists( fileHistMap ):
+            problems.append( message )
+
+        if len( problems ) > 0:
+            for problem in problems:
+                print "Error:", problem
+            print "Error: %s problem(s) found in the requested plots" % len( problems )
+            raise Exception("Missing Hists")
+
+
+    def GetRequestPlan( self ):
+        """ Return the plan of reads, merges and draws of the request cache
+
+        See :py:class:`RequestPlan.RequestPlan`
+        """
+        return RequestPlan( self.requestCache, self.histCache )
+
+
+    def RemoveUpToDateRequests( self ):
+        """ Drop the cached requests whose outputs are up to date
+
+        A request is up to date if its outputs exist and
+        the fingerprint stored next to them (see
+        :py:func:`~helpers.tools.GetRequestFingerprint`)
+        matches the request and its input files.  The
+        other requests get their fingerprint stored once
+        their outputs are remade.
+        """
+
+        # The files of each sample are
+        # only stat'ed once for all requests
+        fileKeys = {}
+        remaining = []
+        for request in self.requestCache:
+            fingerprint = GetRequestFingerprint( request, self.histCache, fileKeys )
+            if fingerprint != None and IsUpToDate( request, fingerprint ):
+                self.logger.debug( "Up to date: %s" % request["OutputName"] )
+                continue
+            request["Fingerprint"] = fingerprint
+            remaining.append( request )
+
+        print "Skipping %s up to date plots, making %s" % (len(self.requestCache) - len(remaining), len(remaining))
+
+        self.requestCache[ : ] = remaining
+
+
+    def GeneratePlotsInCache( self, prefetch=0, validate=False, printStats=False, statsFile=None,
+                              printPlan=False, renderWorkers=0, incremental=False, reorder=False,
+                              book=None ) :
+        """ Generate all plots that have been cached
+        
+        This is to be used after all desired plots
+        have been constructed and cached, usually
+        at the end of a script
+
+        The options are those of
+        :py:meth:`~PlotMaker.PlotMaker.IterGeneratePlotsInCache`.
+        Every request is tried: if any fail, their errors
+        are printed and an exception raised at the end
+        (the failed requests stay in the request cache).
+
+        If 'printStats' is True, a summary of the cache
+        activity (see :py:meth:`HistCollector.HistCollector.PrintStats`)
+        and the time spent saving each format are printed
+        at the end.  If a 'statsFile' is given,
+        it is also written there as JSON.
+        """
+
+        failed = []
+        formatTimes = OrderedDict()
+        for result in self.IterGeneratePlotsInCache( prefetch, validate, printPlan, renderWorkers,
+                                                     incremental, reorder, book ):
+            if result["Error"] != None:
+                failed.append( result )
+            for (format, elapsed) in result["FormatTimes"].iteritems():
+                formatTimes[ format ] = formatTimes.get( format, 0.0 ) + elapsed
+
+        if printStats:
+            self.histCache.PrintStats()
+            if len( formatTimes ) > 0:
+                print "Time spent saving each format (formats of a plot are saved at the same time):"
+                for (format, elapsed) in formatTimes.iteritems():
+                    print "    %-20s %.3f" % (format, elapsed)
+        if statsFile != None:
+            self.histCache.DumpStats( statsFile )
+
+        if len( failed ) > 0:
+            for result in failed:
+                print "Error: Failed to make %s:\n%s" % (result["OutputName"], result["Error"])
+            print "Error: %s of the plots failed" % len( failed )
+            raise Exception("GeneratePlotsInCache")
+
+
+    def IterGeneratePlotsInCache( self, prefetch=0, validate=False, printPlan=False,
+                                  renderWorkers=0, incremental=False, reorder=False, book=None ):
+        """ Generate the cached plots, yielding a result for each
+
+        Each result is a dictionary:
+
+        + Index:      the position of the request in the request cache
+        + OutputName: the request's OutputName
+        + Outputs:    the files it was saved to
+        + Time:       the seconds taken to read what wasn't
+                      prefetched and to draw and save it
+        + Error:      None, or the traceback of what went wrong
+        + FormatTimes: the seconds spent saving each format
+                      (at the same time with ParallelFormats, see
+                      :py:func:`~helpers.tools.PrintCanvasParallel`)
+
+        A request that fails doesn't stop the others.
+        Requests are removed from the request cache as
+        they succeed, so if the loop is stopped early
+        only those left to do (or failed) remain.
+
+        By default every histogram is cached before
+        the first plot is drawn.  If 'prefetch' is more
+        than 0, the histograms of the next 'prefetch'
+        requests are instead read in the background
+        (by the number of processes given to
+        :py:meth:`~PlotMaker.PlotMaker.SetNumWorkers`)
+        while the current plot is drawn
+
+        If 'validate' is True, every histogram is
+        first checked to exist (see
+        :py:meth:`~PlotMaker.PlotMaker.ValidateRequests`)
+
+        The requests are first compiled into a
+        :py:class:`RequestPlan.RequestPlan`, so histograms
+        shared by several requests are merged once and
+        released once the last of them has been drawn.
+        If 'printPlan' is True, its summary is printed.
+
+        If 'reorder' is True, the requests are drawn in an
+        order that keeps those using the same histograms
+        together (see :py:meth:`RequestPlan.RequestPlan.GetLocalOrder`),
+        and each request's histograms are only read just
+        before it's drawn.  The cache then only holds what
+        the current requests need, rather than everything.
+
+        If 'incremental' is True, requests whose outputs are
+        up to date are skipped (see
+        :py:meth:`~PlotMaker.PlotMaker.RemoveUpToDateRequests`)
+
+        If 'renderWorkers' is more than 1, the plots are
+        drawn and saved by that many worker processes
+        (see :py:meth:`~PlotMaker.PlotMaker.IterPlotsInWorkers`)
+
+        If a 'book' is given (a file name such as 'plots.pdf',
+        or a :py:class:`PlotBook.PlotBook`), every plot is added
+        as a page of one or several multi-page PDFs instead of
+        being saved to its own files.  Each result's Outputs is
+        then the PDF its page is in, and its Page the page number.
+        A table of contents is written when the book is closed,
+        once every request is done (or the loop stopped).
+        Books are drawn here, in order, and can't be incremental.
+        """
+
+        if book != None:
+            if incremental:
+                print "Error: Plots in a book can't be made incrementally"
+                raise Exception("IterGeneratePlotsInCache - Book")
+            if renderWorkers > 1:
+                self.logger.warning( "IterGeneratePlotsInCache: Drawing the book's pages here, not in %s workers" % renderWorkers )
+                renderWorkers = 0
+            if isinstance( book, basestring ):
+                book = PlotBook( book )
+
+        if incremental:
+            self.RemoveUpToDateRequests()
+
+        if validate:
+            self.ValidateRequests()
+
+        plan = self.GetRequestPlan()
+        if reorder:
+            self.requestCache[ : ] = [ self.requestCache[ index ] for index in plan.GetLocalOrder() ]
+            plan = self.GetRequestPlan()
+        if printPlan:
+            plan.PrintSummary()
+
+        requests = list( self.requestCache )
+        done = set()
+
+        # Unless reordered, read all
+        # histograms before drawing
+        readAll = not reorder
+
+        if renderWorkers > 1:
+            results = self.IterPlotsInWorkers( requests, plan, renderWorkers, prefetch, readAll )
+        else:
+            results = self.IterPlots( requests, plan, prefetch, readAll )
+
+        SetCurrentBook( book )
+        try:
+            for result in results:
+                if result["Error"] == None:
+                    done.add( id( requests[ result["Index"] ] ) )
+                if book != None:
+                    AddBookPage( result, book )
+                yield result
+        finally:
+            results.close()
+
+            if book != None:
+                SetCurrentBook( None )
+                book.Close()
+
+            # Only keep what's left to do
+            self.requestCache[ : ] = [ request for request in self.requestCache if id( request ) not in done ]
+
+            # Release the open input files
+            self.histCache.CloseAllFiles()
+
+
+    def ReadForRequest( self, plan, index, prefetcher=None, prefetch=0 ):
+        """ Cache the histograms a request of a plan needs
+
+        Only histograms whose merge isn't cached are read
+        (see :py:meth:`RequestPlan.RequestPlan.GetReads`),
+        in file order.  With a 'prefetcher', also start
+        reading those of the next 'prefetch' requests
+        in the background.
+        """
+        reads = self.histCache.GetReadPlan( plan.GetReads( index ) )
+        if prefetcher != None:
+            prefetcher.Prefetch( reads )
+            for ahead in range( index+1, min( index+prefetch+1, len(plan.DrawMerges) ) ):
+                prefetcher.Prefetch( self.histCache.GetReadPlan( plan.GetReads( ahead ) ) )
+            prefetcher.Collect( reads )
+        else:
+            for (file, histList) in reads.iteritems():
+                self.histCache.CacheHists( file, histList )
+
+
+    def IterPlots( self, requests, plan, prefetch=0, readAll=True ):
+        """ Generate a list of requests here, yielding a result for each
+
+        See :py:meth:`~PlotMaker.PlotMaker.IterGeneratePlotsInCache`.
+        If 'prefetch' is 0, the histograms are all cached first
+        (if 'readAll') or request by request.  Otherwise, before
+        each request is drawn, the reads for it and the following
+        'prefetch' requests (from the 'plan', see
+        :py:class:`RequestPlan.RequestPlan`) are handed to a
+        :py:class:`~HistCollector.HistPrefetcher`.
+        Only the current request's histograms are waited for.
+        """
 
+        prefetcher = None
+        try:
+            if prefetch > 0:
+                prefetcher = HistPrefetcher( self.histCache, self.__numWorkers )
+            elif readAll:
+                # Cache the Hists, opening
+                # each file only once
+                self.FillCachedHistograms()
+
+            for (index, request) in enumerate( requests ):
+                start = time.time()
+                error = None
+                PopFormatTimes()
+                try:
+                    self.ReadForRequest( plan, index, prefetcher, prefetch )
+                    self.GeneratePlot( request )
+                except Exception:
+                    error = traceback.format_exc()
+                plan.Finish( index )
+                yield GetResult( index, request, time.time() - start, error, PopFormatTimes() )
+        finally:
+            if prefetcher != None:
+                prefetcher.Close()
+
+
+    def GetMergedHists( self, request ):
+        """ Return the merged histograms a request draws
+
+        Return a list of ((files, name), TH1), one for
+        each different histogram of the request, as
+        :py:func:`~helpers.tools.GetHist` returns it.
+        The histograms are owned by the caller.
+        """
+        mergedHists = []
+        merges = []
+        for plot in request["Plots"]:
+            merge = ( tuple( plot["FileList"] ), GetHistName( plot ) )
+            if merge in merges:
+                continue
+            merges.append( merge )
+            mergedHists.append( (merge, GetHist( plot, self.histCache )) )
+        return mergedHists
+
+
+    def IterPlotsInWorkers( self, requests, plan, renderWorkers, prefetch=0, readAll=True ):
+        """ Generate a list of requests using several processes
+
+        Histograms are read and merged here (all at first,
+        request by request, or with 'prefetch' in the
+        background, see :py:meth:`~PlotMaker.PlotMaker.IterPlots`).
+        Each request and its merged histograms are then
+        sent to one of a pool of 'renderWorkers' processes
+        (see :py:func:`RenderRequest`) which draws and saves
+        it, using the same helpers as
+        :py:meth:`~PlotMaker.PlotMaker.GeneratePlot`.
+        A result is yielded for each request as it's
+        done (see :py:meth:`~PlotMaker.PlotMaker.IterGeneratePlotsInCache`),
+        in the order of the requests.
+        """
+
+        import multiprocessing
+
+        # Start the workers before caching the
+        # histograms, so they don't hold a copy
+        pool = multiprocessing.Pool( processes=renderWorkers )
+
+        prefetcher = None
+        pending = []
+        try:
+            if prefetch > 0:
+                prefetcher = HistPrefetcher( self.histCache, self.__numWorkers )
+            elif readAll:
+                self.FillCachedHistograms()
+
+            for (index, request) in enumerate( requests ):
+
+                start = time.time()
+                try:
+                    self.ReadForRequest( plan, index, prefetcher, prefetch )
+
+                    if not CanRenderInWorker( request ):
+                        PopFormatTimes()
+                        self.GeneratePlot( request )
+                        plan.Finish( index )
+                        pending.append( (index, time.time() - start, (None, PopFormatTimes())) )
+                        continue
+
+                    # Pickle here, so the histograms can
+                    # be deleted as soon as they're sent
+                    mergedHists = self.GetMergedHists( request )
+                    payload = pickle.dumps( (request, mergedHists), pickle.HIGHEST_PROTOCOL )
+                    for (merge, hist) in mergedHists:
+                        hist.Delete()
+                    plan.Finish( index )
+
+                    pending.append( (index, time.time() - start, pool.apply_async( RenderRequest, [payload] )) )
+
+                except Exception:
+                    plan.Finish( index )
+                    pending.append( (index, time.time() - start, traceback.format_exc()) )
+
+                # Don't get too far ahead of the workers
+                while len( pending ) > 2*renderWorkers or (len( pending ) > 0 and IsDone( pending[0][2] )):
+                    yield GetWorkerResult( requests, *pending.pop( 0 ) )
+
+            while len( pending ) > 0:
+                yield GetWorkerResult( requests, *pending.pop( 0 ) )
+
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            if prefetcher != None:
+                prefetcher.Close()
+
+
+
+def DrawRequest( request, histCache ):
+    """ Draw and save a request with the helper of its type
+
+    See :py:meth:`~PlotMaker.PlotMaker.GeneratePlot`
+    """
+
+    plotType   = request["Type"]
+    outputName = request["OutputName"]
+
+    try:
         if plotType == "":
             print "Error: No Plot type found"
             raise Exception("PlotGenerator - PlotType")
 
         elif plotType == "SamplePlot":
-            MakeMultiplePlot( outputName, request )
+            MakeMultiplePlot( outputName, request, histCache )
 
         elif plotType == "EfficiencyPlot":
-            MakeQuotientPlot( outputName, request )
+            MakeQuotientPlot( outputName, request, histCache )
 
         elif plotType == "MCDataStack":
-            MakeMCDataStack( outputName, request )
+            MakeMCDataStack( outputName, request, histCache )
 
         elif plotType == "Stack":
-            MakeStack( outputName, request )
+            MakeStack( outputName, request, histCache )
 
         elif plotType == "MCStack":
-            MakeMCStack( outputName, request )
+            MakeMCStack( outputName, request, histCache )
 
         elif plotType == "MultipleSamplePlot":
-            MakeMultiplePlot( outputName, request )
+            MakeMultiplePlot( outputName, request, histCache )
 
         elif plotType == "MultipleVariablePlot":
-            MakeMultiplePlot( outputName, request )
+            MakeMultiplePlot( outputName, request, histCache )
 
         elif plotType == "MultipleTH1Plot":
-            MakeMultipleTH1Plot( outputName, request )
+            MakeMultipleTH1Plot( outputName, request, histCache )
 
         else:
             print "Error: Plot Type %s not known"
             raise Exception("PlotGenerator - PlotType");
 
+    except:
+        # Don't keep a failed plot's
+        # canvas out of the canvas pool
+        ReleaseAllCanvases()
+        raise
 
-    def FillCachedHistograms( self ):
-        """ Cache all histograms in the request cache
+    # In incremental mode, record what
+    # the new outputs were made from
+    if request.get("Fingerprint"):
+        WriteFingerprint( request )
 
-        This is the real advantage of the cache:
-        - Loop through all requests in the request cache
-        - Get the names and files of all histograms that will be needed
-        - Loop over each file and cache all the necessary histograms
 
-        The idea is that each file needs to only be opened once, which
-        saves a lot of time in I/O
-        """
+def CanRenderInWorker( request ):
+    """ Return whether a request can be drawn by a worker process
 
-        FileHistMap = {}
+    Requests holding their own TH1's (rather
+    than histogram names) are drawn here
+    """
+    for plot in request["Plots"]:
+        if not isinstance( plot["Hist"], basestring ):
+            return False
+    return True
+
+
+def RenderRequest( payload ):
+    """ Draw a request in a worker process
+
+    'payload' is a pickled (request, mergedHists), where
+    mergedHists is a list of ((files, name), TH1) with
+    every histogram of the request already merged.  They
+    are put in a fresh HistCollector, so drawing the
+    request never reads the input files.
+    Return the time taken, the traceback of any
+    error (or None) and the time spent saving
+    each format (see :py:func:`~helpers.tools.PopFormatTimes`)
+    """
 
-        for request in self.requestCache:
-            for plot in request["Plots"]:
-                
-                name = plot["Hist"]
-                
-                # Each plot may draw from multiple files
-                # get those using glob:
-                if "FileList" not in plot:
-                    FileList = glob.glob( plot["Files"] )
-
-                fileList = plot["FileList"]
-
-                for file in fileList:
-                    # Create the list 
-                    #if it's not already there
-                    if file not in FileHistMap:
-                        FileHistMap[ file ] = []
-                    # Add to the list:
-                    FileHistMap[ file ].append( name )
-                pass
-            pass
+    start = time.time()
+    PopFormatTimes()
 
-        # Now that we have the list, 
-        # Let's cache all histograms
-        for file, histlist in FileHistMap.iteritems():
-            self.histCache.CacheHists( file, histlist )
+    try:
+        (request, mergedHists) = pickle.loads( payload )
 
-        print "Successfully cached all histograms"
-    
+        ROOT.gROOT.SetBatch( True )
 
-    def ClearHistCache( self ):
-        """ Clear the histogram Cache """
-        self.histCache.ClearCache()
+        histCache = HistCollector()
+        for ((files, name), hist) in mergedHists:
+            histCache.AddToCache( files, name, hist )
 
+        DrawRequest( request, histCache )
 
-    def GeneratePlotsInCache( self ) :
-        """ Generate all plots that have been cached
-        
-        This is to be used after all desired plots
-        have been constructed and cached, usually
-        at the end of a script
-        """
+        histCache.ClearCache()
+        histCache.CloseAllFiles()
 
-        # Cache the Hists, opening
-        # each file only once
-        self.FillCachedHistograms()
+    except Exception:
+        return (time.time() - start, traceback.format_exc(), PopFormatTimes())
 
-        # Make the Plots
-        for request in self.requestCache:
-            self.GeneratePlot( request )
+    return (time.time() - start, None, PopFormatTimes())
+
+
+def GetRequestCost( request ):
+    """ Estimate the cost of a request
+
+    The number of (file, histogram) pairs it reads
+    """
+    cost = 0
+    for plot in request["Plots"]:
+        cost += max( 1, len( plot.get("FileList", []) ) )
+    return cost
+
+
+def GetShard( requests, shard, numShards ):
+    """ Return the requests of one shard out of 'numShards'
+
+    Shards are balanced by the estimated cost of their
+    requests (see :py:func:`GetRequestCost`): the most
+    expensive requests are handed out first, each to the
+    cheapest shard so far.  The result only depends on
+    the requests, so every shard of a run agrees on it.
+    Requests keep their order within the shard.
+    """
+
+    if numShards < 1 or shard < 0 or shard >= numShards:
+        print "Error: Shard %s of %s doesn't exist" % (shard, numShards)
+        raise Exception("Shard")
+
+    costs = [ GetRequestCost( request ) for request in requests ]
+    byCost = sorted( range( len( requests ) ), key=lambda index: (-costs[ index ], index) )
+
+    totals = [ 0 ] * numShards
+    chosen = []
+    for index in byCost:
+        cheapest = min( range( numShards ), key=lambda i: (totals[ i ], i) )
+        totals[ cheapest ] += costs[ index ]
+        if cheapest == shard:
+            chosen.append( index )
+
+    return [ requests[ index ] for index in sorted( chosen ) ]
 
-        # Clear the request cache
-        del self.requestCache[ : ]
 
+def EncodeStrings( value ):
+    """ Return a copy of data loaded from JSON with str instead of unicode
+
+    """
+    if isinstance( value, unicode ):
+        return value.encode( "utf-8" )
+    if isinstance( value, list ):
+        return [ EncodeStrings( item ) for item in value ]
+    if isinstance( value, dict ):
+        return dict( [ (EncodeStrings( key ), EncodeStrings( item )) for (key, item) in value.iteritems() ] )
+    return value
+
+
+def IsDone( outcome ):
+    """ Return whether a request sent to a worker has been drawn
+
+    'outcome' is the AsyncResult of a request sent
+    to a worker, or the traceback (or None) of
+    a request that failed here, or the (None,
+    format times) of one drawn here
+    """
+    if outcome == None or isinstance( outcome, (basestring, tuple) ):
+        return True
+    return outcome.ready()
+
+
+def GetWorkerResult( requests, index, elapsed, outcome ):
+    """ Wait for a request sent to a worker and return its result
+
+    See :py:func:`IsDone` for the 'outcome'.  The time
+    is that spent here plus that spent by the worker
+    """
+    error = outcome
+    formatTimes = None
+    if isinstance( outcome, tuple ):
+        (error, formatTimes) = outcome
+    elif outcome != None and not isinstance( outcome, basestring ):
+        try:
+            (workerTime, error, formatTimes) = outcome.get()
+            elapsed += workerTime
+        except Exception:
+            error = traceback.format_exc()
+    return GetResult( index, requests[ index ], elapsed, error, formatTimes )
+
+
+def AddBookPage( result, book ):
+    """ Point a result to the book page its plot was added to
+
+    See :py:meth:`~PlotMaker.PlotMaker.IterGeneratePlotsInCache`
+    """
+    entry = book.GetEntry( result["OutputName"] )
+    if entry == None:
+        result["Outputs"] = []
+        return
+    result["Outputs"] = [ entry["File"] ]
+    result["Page"] = entry["Page"]
+
+
+def GetResult( index, request, elapsed, error, formatTimes=None ):
+    """ Return the result record of a generated request
+
+    See :py:meth:`~PlotMaker.PlotMaker.IterGeneratePlotsInCache`
+    """
+    outputs = []
+    if "OutputName" in request:
+        outputs = GetOutputNames( request )
+    if formatTimes == None:
+        formatTimes = OrderedDict()
+    return { "Index" : index, "OutputName" : request.get("OutputName"),
+             "Outputs" : outputs, "Time" : elapsed, "Error" : error,
+             "FormatTimes" : formatTimes }
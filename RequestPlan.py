@@ -0,0 +1,241 @@
+
+import sys
+import logging
+
+# Import native OrderedDict, or use
+# local version for python < 2.7
+if sys.version_info >= (2, 7):
+    from collections import OrderedDict
+else:
+    from OrderedDict import *
+
+from helpers.tools import GetHistName
+from HistCollector import GetKeyPath
+
+
+class RequestPlan():
+    """ The graph of work needed to draw a list of requests
+
+    The requests (see :py:class:`PlotMaker.PlotMaker`) are
+    compiled into three kinds of nodes:
+
+    + Reads:  a histogram read from one file, (file, name)
+    + Merges: a histogram summed over a sample's files, (files, name)
+    + Draws:  a request, drawn and saved (by index)
+
+    Each read feeds the merges using it and each
+    merge feeds the draws using it.  Several requests
+    drawing the same variable of the same sample
+    share one merge (memoized in the HistCollector,
+    see :py:meth:`HistCollector.HistCollector.CacheMergedHist`).
+    Scaling and styling are applied by each draw to its
+    own copy of a merge, so they're part of the draw.
+
+    Once a request has been drawn, call
+    :py:meth:`~RequestPlan.RequestPlan.Finish`: the
+    merges (and reads) no remaining request needs are
+    released from the HistCollector's cache.
+    """
+
+    def __init__( self, requests, histCache ):
+        self.HistCache = histCache
+
+        # Node -> number of consumers
+        # that haven't finished yet
+        self.Reads = OrderedDict()
+        self.Merges = OrderedDict()
+        self.MergesMade = set()
+
+        # Merge -> its reads, and
+        # request index -> its merges
+        self.MergeReads = {}
+        self.DrawMerges = []
+
+        for request in requests:
+            merges = []
+            for plot in request["Plots"]:
+
+                # Some plots are given their TH1's directly
+                if not isinstance( plot["Hist"], basestring ):
+                    continue
+
+                # As GetHist does, glob the files
+                # if the plot doesn't list them
+                if "FileList" not in plot or len( plot["FileList"] ) == 0:
+                    plot["FileList"] = histCache.Glob( plot["Files"] )
+
+                merge = ( tuple( plot["FileList"] ), GetHistName( plot ) )
+                if merge in merges:
+                    continue
+                merges.append( merge )
+
+                if merge not in self.Merges:
+                    self.Merges[ merge ] = 0
+                    (files, name) = merge
+                    self.MergeReads[ merge ] = [ (file, name) for file in files ]
+                    for read in self.MergeReads[ merge ]:
+                        self.Reads[ read ] = self.Reads.get( read, 0 ) + 1
+                self.Merges[ merge ] += 1
+
+            self.DrawMerges.append( merges )
+
+        self.Finished = [ False ] * len( self.DrawMerges )
+
+
+    def GetReads( self, index ):
+        """ Return the file -> hist list map of the reads a request needs
+
+        Only reads whose merge isn't already cached are listed
+        """
+        fileHistMap = OrderedDict()
+        for merge in self.DrawMerges[ index ]:
+            if self.HistCache.IsCached( *merge ):
+                continue
+            for (file, name) in self.MergeReads[ merge ]:
+                if file not in fileHistMap:
+                    fileHistMap[ file ] = []
+                if name not in fileHistMap[ file ]:
+                    fileHistMap[ file ].append( name )
+        return fileHistMap
+
+
+    def Finish( self, index ):
+        """ Mark a request as drawn and release what's no longer needed
+
+        Its merges have all been made, so none of their
+        reads are needed any more.  Merges no remaining
+        request uses are removed from the cache.
+        """
+        if self.Finished[ index ]:
+            return
+        self.Finished[ index ] = True
+
+        for merge in self.DrawMerges[ index ]:
+
+            # The merge has been made: release
+            # the reads no other merge needs
+            if merge not in self.MergesMade:
+                self.MergesMade.add( merge )
+                for read in self.MergeReads[ merge ]:
+                    self.Reads[ read ] -= 1
+                    if self.Reads[ read ] == 0:
+                        self.HistCache.RemoveFromCache( *read )
+
+            self.Merges[ merge ] -= 1
+            if self.Merges[ merge ] == 0:
+                logging.debug( "RequestPlan - \t Releasing merged hist: %s" % merge[1] )
+                self.HistCache.RemoveFromCache( *merge )
+
+
+    def GetLocalOrder( self ):
+        """ Return an order of the requests that keeps reuse close together
+
+        Starting from the first request, always go on
+        to the remaining request sharing the most merges
+        with the last one, then the one drawing the most
+        histograms from the same directories, and
+        otherwise the first remaining one.  Requests
+        using the same histograms then follow each other,
+        so what they share can be released (see
+        :py:meth:`~RequestPlan.RequestPlan.Finish`) soon
+        after it's made.  Return a list of request indices.
+        """
+
+        mergeUsers = {}
+        dirUsers = {}
+        for (index, merges) in enumerate( self.DrawMerges ):
+            for merge in merges:
+                mergeUsers.setdefault( merge, [] ).append( index )
+                for dir in GetMergeDirs( [merge] ):
+                    users = dirUsers.setdefault( dir, [] )
+                    if index not in users:
+                        users.append( index )
+
+        remaining = set( range( len( self.DrawMerges ) ) )
+        order = []
+        current = None
+
+        while len( remaining ) > 0:
+
+            next = None
+            if current != None:
+                next = GetBestUser( [ mergeUsers[ merge ] for merge in self.DrawMerges[ current ] ], remaining )
+                if next == None:
+                    next = GetBestUser( [ dirUsers[ dir ] for dir in GetMergeDirs( self.DrawMerges[ current ] ) ], remaining )
+            if next == None:
+                next = min( remaining )
+
+            order.append( next )
+            remaining.remove( next )
+            current = next
+
+        return order
+
+
+    def GetSummary( self ):
+        """ Return the number of nodes and the expected reads
+
+        EstimatedReads counts the reads that are neither
+        in the HistCollector's memory nor on-disk cache,
+        EstimatedBytes their uncompressed size (for files
+        whose key index has already been made)
+        """
+        summary = OrderedDict()
+        summary[ "Draws" ] = len( self.DrawMerges )
+        summary[ "MergeUses" ] = sum( [ len( merges ) for merges in self.DrawMerges ] )
+        summary[ "Merges" ] = len( self.Merges )
+        summary[ "SharedMerges" ] = len( [ merge for (merge, count) in self.Merges.iteritems() if count > 1 ] )
+        summary[ "Reads" ] = len( self.Reads )
+        summary[ "Files" ] = len( set( [ file for (file, name) in self.Reads ] ) )
+
+        estimatedReads = 0
+        estimatedBytes = 0
+        for (file, name) in self.Reads:
+            if self.HistCache.IsCached( file, name ):
+                continue
+            if self.HistCache.DiskCache != None and self.HistCache.DiskCache.Has( file, name ):
+                continue
+            estimatedReads += 1
+            entry = self.HistCache.KeyIndex.GetIndexedEntry( file, GetKeyPath( name ) )
+            if entry != None:
+                estimatedBytes += entry["ObjLen"]
+        summary[ "EstimatedReads" ] = estimatedReads
+        summary[ "EstimatedBytes" ] = estimatedBytes
+
+        return summary
+
+
+    def PrintSummary( self ):
+        """ Print the number of nodes of each kind and the expected reads
+
+        """
+        print "RequestPlan:"
+        for (key, value) in self.GetSummary().iteritems():
+            print "    %-20s %s" % (key, value)
+
+
+def GetMergeDirs( merges ):
+    """ Return the directories (in their files) of merged histograms
+
+    """
+    dirs = []
+    for (files, name) in merges:
+        dir = name.rpartition( "/" )[0]
+        if dir not in dirs:
+            dirs.append( dir )
+    return dirs
+
+
+def GetBestUser( userLists, remaining ):
+    """ Return the remaining request found in the most lists, or None
+
+    Ties go to the first request
+    """
+    counts = {}
+    for users in userLists:
+        for index in users:
+            if index in remaining:
+                counts[ index ] = counts.get( index, 0 ) + 1
+    if len( counts ) == 0:
+        return None
+    return min( counts.keys(), key=lambda index: (-counts[ index ], index) )
@@ -0,0 +1,182 @@
+
+#
+# Compact descriptions of samples and
+# of the plots made from them.
+#
+# A Sample holds what was given to
+# PlotMaker.AddDataSample, AddMCSample or
+# AddBSMSample.  It never changes, and its
+# (possibly very long) list of files is a
+# tuple shared by every plot of the sample.
+#
+# A PlotEntry is one sample in one request.  It
+# only stores what the request changes (Hist,
+# style options, etc) and reads everything else
+# from its sample, so making one costs the same
+# however many files the sample has.
+#
+# Both are read like the dictionaries
+# they replace: plot["Hist"], plot.get("Color"),
+# "Scale" in plot, etc.
+#
+
+
+class Sample( object ):
+    """ An immutable sample descriptor
+
+    Keys that weren't given (eg Color for data)
+    are absent, as they were from the sample
+    dictionaries.  Use :py:meth:`~Samples.Sample.Replace`
+    to get a changed copy.
+    """
+
+    __slots__ = ( "Name", "Files", "FileList", "Title", "Prefix", "Type",
+                  "ScaleByLumi", "Scale", "Color", "LineStyle", "Signal", "SkimFile" )
+
+    def __init__( self, **fields ):
+        for (key, value) in fields.iteritems():
+            if key == "FileList":
+                value = tuple( value )
+            object.__setattr__( self, key, value )
+
+    def __setattr__( self, key, value ):
+        raise TypeError( "Samples can't be changed, use Replace" )
+
+    def __setitem__( self, key, value ):
+        raise TypeError( "Samples can't be changed, use Replace" )
+
+    def __getitem__( self, key ):
+        if key not in self.__slots__ or not hasattr( self, key ):
+            raise KeyError( key )
+        return getattr( self, key )
+
+    def __contains__( self, key ):
+        return key in self.__slots__ and hasattr( self, key )
+
+    def get( self, key, default=None ):
+        if key in self:
+            return getattr( self, key )
+        return default
+
+    def keys( self ):
+        return [ key for key in self.__slots__ if hasattr( self, key ) ]
+
+    def iteritems( self ):
+        for key in self.keys():
+            yield (key, getattr( self, key ))
+
+    def items( self ):
+        return list( self.iteritems() )
+
+    def __iter__( self ):
+        return iter( self.keys() )
+
+    def Replace( self, **changes ):
+        """ Return a copy of the sample with some keys changed
+
+        """
+        fields = dict( self.iteritems() )
+        fields.update( changes )
+        return Sample( **fields )
+
+    def ToDict( self ):
+        return dict( self.iteritems() )
+
+    # Immutable: copies can be shared
+    def __copy__( self ):
+        return self
+
+    def __deepcopy__( self, memo ):
+        return self
+
+    def __getstate__( self ):
+        return self.ToDict()
+
+    def __setstate__( self, state ):
+        Sample.__init__( self, **state )
+
+    def __repr__( self ):
+        return "Sample(%s)" % self.ToDict()
+
+
+class PlotEntry( object ):
+    """ A sample as used by one request, with its own overrides
+
+    Setting a key only changes this entry.  Copies
+    (including deep copies) share the sample.
+    """
+
+    __slots__ = ( "Sample", "Overrides" )
+
+    def __init__( self, sample, overrides=None ):
+        if overrides == None:
+            overrides = {}
+        self.Sample = sample
+        self.Overrides = overrides
+
+    def __getitem__( self, key ):
+        if key in self.Overrides:
+            return self.Overrides[ key ]
+        return self.Sample[ key ]
+
+    def __setitem__( self, key, value ):
+        self.Overrides[ key ] = value
+
+    def __delitem__( self, key ):
+        del self.Overrides[ key ]
+
+    def __contains__( self, key ):
+        return key in self.Overrides or key in self.Sample
+
+    def get( self, key, default=None ):
+        if key in self.Overrides:
+            return self.Overrides[ key ]
+        return self.Sample.get( key, default )
+
+    def update( self, *args, **kwargs ):
+        self.Overrides.update( *args, **kwargs )
+
+    def keys( self ):
+        return self.Sample.keys() + [ key for key in self.Overrides if key not in self.Sample ]
+
+    def iteritems( self ):
+        for key in self.keys():
+            yield (key, self[ key ])
+
+    def items( self ):
+        return list( self.iteritems() )
+
+    def __iter__( self ):
+        return iter( self.keys() )
+
+    def copy( self ):
+        return PlotEntry( self.Sample, dict( self.Overrides ) )
+
+    def __copy__( self ):
+        return self.copy()
+
+    def __deepcopy__( self, memo ):
+        import copy
+        return PlotEntry( self.Sample, copy.deepcopy( self.Overrides, memo ) )
+
+    def ToDict( self ):
+        return dict( self.iteritems() )
+
+    def __getstate__( self ):
+        return (self.Sample, self.Overrides)
+
+    def __setstate__( self, state ):
+        (self.Sample, self.Overrides) = state
+
+    def __repr__( self ):
+        return "PlotEntry(%s)" % self.ToDict()
+
+
+def ToJSON( value ):
+    """ Convert samples and plot entries to dictionaries for json
+
+    Use as json.dump( ..., default=ToJSON )
+    """
+    if isinstance( value, (Sample, PlotEntry) ):
+        return value.ToDict()
+    raise TypeError( "%r is not JSON serializable" % value )
@@ -39,7 +39,7 @@ def MakeDataPlot( outputName, request, histCache=None ):
 
     if not request.get("UseCurrentCanvas"):
         SaveCanvas( canvas, request, outputName )
-        canvas.Close()
+        ReleaseCanvas( canvas )
         del canvas
 
     return (legend)
@@ -57,8 +57,12 @@ def MakeMCDataStack( outputName, request, histCache=None ):
 
     if not request.get("UseCurrentCanvas"):
         SaveCanvas( canvas, request, outputName )
-        canvas.Close()
+        ReleaseCanvas( canvas )
         del canvas
+        # The pads go back to the pool with
+        # the canvas, so don't hand them out
+        TopPad = None
+        BottomPad = None
 
     return (stack, legend, ratio_list, TopPad, BottomPad)
 
@@ -107,7 +111,7 @@ def DrawMCDataStack( dataHistList, mcHistList, bsmHistList, request={} ):
         # mchist.SetFillColor(color)
         # mchist.SetLineColor(color)
         logging.debug( "DrawMCDataStack - Adding MC Hist to stack: %s %s" % (name, mchist) )
-        stack.Add( mchist )
+        stack.Add( Materialize(mchist) )
         #stack.Draw( "HIST SAME" )
         legendEntries.append( [mchist, name, "f"] )
         #logging.debug( "Adding mc histogram to stack: %s (color = %d )" % (name, color) )
@@ -125,7 +129,7 @@ def DrawMCDataStack( dataHistList, mcHistList, bsmHistList, request={} ):
 
     # Draw the BSM hists:
     for name, bsmhist in bsmHistList:
-        legend.AddEntry( bsmhist, name, "l" )
+        legend.AddEntry( Materialize(bsmhist), name, "l" )
         bsmhist.Draw("HIST SAME")
 
     legend.Draw()
@@ -157,11 +161,11 @@ def DrawRatioPlot(mcList, dataHistList, request=None):
     (templateName, templateHist) = mcList[0]
     denominator = templateHist.Clone(templateName + "_denominator")
     for (name, hist) in mcList[1:]:
-        denominator.Add(hist)
+        denominator.Add(Materialize(hist))
 
     # Get the Ratio
     ratio = dhist.Clone(dName + "_ratio")        
-    ratio.Divide(denominator)
+    ratio.Divide(Materialize(denominator))
 
     ratio.SetAxisRange( 0, 2, "Y" )
 
@@ -18,8 +18,7 @@ def MakeMCStack( outputName, request, histCache=None ):
     """
     
     # Create a canvas:
-    canvas = ROOT.TCanvas("canvas", "Canvas for plot making", 800, 600 )
-    canvas.cd()
+    canvas = GetPooledCanvas()[0]
 
     # Get the Lists of histograms
     mcHistList  = GetMCNameHistList(  request, histCache ) 
@@ -41,7 +40,7 @@ def MakeMCStack( outputName, request, histCache=None ):
 
     SaveCanvas( canvas, request, outputName )
 
-    canvas.Close()
+    ReleaseCanvas( canvas )
     del canvas
 
     return
@@ -63,7 +62,7 @@ def DrawMCStack( mcHistList, bsmHistList, request={} ):
     addedSamples = None
     for (name, hist) in mcHistList: # + bsmHistList:
         if addedSamples:
-            addedSamples.Add ( hist )
+            addedSamples.Add ( Materialize(hist) )
         else:
             addedSamples = hist.Clone()
         pass
@@ -78,7 +77,7 @@ def DrawMCStack( mcHistList, bsmHistList, request={} ):
         # mchist.SetFillColor(color)
         # mchist.SetLineColor(color)
         logging.debug( "DrawMCDataStack - Adding Hist to stack: %s %s" % (name, hist) )
-        stack.Add( hist )
+        stack.Add( Materialize(hist) )
         legendEntries.append( [hist, name, "f"] )
         #logging.debug( "Adding mc histogram to stack: %s (color = %d )" % (name, color) )
         pass
@@ -93,7 +92,7 @@ def DrawMCStack( mcHistList, bsmHistList, request={} ):
 
     # Draw the BSM hists:
     for name, bsmhist in bsmHistList:
-        legend.AddEntry( bsmhist, name, "l" )
+        legend.AddEntry( Materialize(bsmhist), name, "l" )
         bsmhist.Draw("HIST SAME")
 
 
@@ -50,8 +50,12 @@ def MakeMultiplePlot( outputName, request, histCache=None ):
 
     if not request.get("UseCurrentCanvas"):
         SaveCanvas( canvas, request, outputName )    
-        canvas.Close()
+        ReleaseCanvas( canvas )
         del canvas
+        # The pads go back to the pool with
+        # the canvas, so don't hand them out
+        TopPad = None
+        BottomPad = None
 
     return (histList, legend, ratio_list, TopPad, BottomPad)
 
@@ -74,7 +78,7 @@ def DrawMultiplePlot( histList, request={} ):
     addedSamples = None
     for (name, h1d) in histList:
         if addedSamples:
-            addedSamples.Add ( h1d )
+            addedSamples.Add ( Materialize(h1d) )
         else:
             addedSamples = h1d.Clone()
         pass
@@ -19,9 +19,7 @@ def MakeMultipleTH1Plot( outputName, request, histCache=None ):
     logging.debug( "MakeHistogramPlot" )
 
     # Create a canvas:
-    ROOT.gROOT.cd()
-    canvas = ROOT.TCanvas("canvas", "Canvas for plot making", 800, 600 )
-    canvas.cd()
+    canvas = GetPooledCanvas()[0]
 
     # Get the histograms from the plot list, 
     # styling when necessary
@@ -46,7 +44,7 @@ def MakeMultipleTH1Plot( outputName, request, histCache=None ):
 
     SaveCanvas( canvas, request, outputName )
     
-    canvas.Close()
+    ReleaseCanvas( canvas )
     del canvas
 
     return
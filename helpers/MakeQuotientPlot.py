@@ -19,9 +19,7 @@ def MakeQuotientPlot( outputName, request, histCache=None ):
     logging.debug( "MakeMultiplePlot" )
 
     # Create a canvas:
-    ROOT.gROOT.cd()
-    canvas = ROOT.TCanvas("canvas", "Canvas for plot making", 800, 600 )
-    canvas.cd()
+    canvas = GetPooledCanvas()[0]
 
     # Get the histograms
     # First is numerator, second is denominator
@@ -46,7 +44,7 @@ def MakeQuotientPlot( outputName, request, histCache=None ):
     Efficiency = numHist.Clone()
     
     # Divide by Denominator
-    Efficiency.Divide( denomHist )
+    Efficiency.Divide( Materialize(denomHist) )
     EfficiencyName = histList[0][0]
 
     # Format for drawing multiple Plot
@@ -61,7 +59,7 @@ def MakeQuotientPlot( outputName, request, histCache=None ):
 
     SaveCanvas( canvas, request, outputName )
     
-    canvas.Close()
+    ReleaseCanvas( canvas )
     del canvas
 
     return
@@ -18,10 +18,7 @@ def MakeStack( outputName, request, histCache=None ):
     """
 
     # Create a canvas:
-    ROOT.gROOT.cd()
-    canvas = ROOT.TCanvas("canvas", "Canvas for plot making", 800, 600 )
-    canvas.cd()
-    canvas.cd()
+    canvas = GetPooledCanvas()[0]
 
     # Get the data hist
     nameHistList = []
@@ -48,7 +45,7 @@ def MakeStack( outputName, request, histCache=None ):
 
     SaveCanvas( canvas, request, outputName )
 
-    canvas.Close()
+    ReleaseCanvas( canvas )
     del canvas
 
     return
@@ -85,7 +82,7 @@ def DrawStack( nameHistList, request={} ):
         # mchist.SetFillColor(color)
         # mchist.SetLineColor(color)
         logging.debug( "DrawMCDataStack - Adding Hist to stack: %s %s" % (name, hist) )
-        stack.Add( hist )
+        stack.Add( Materialize(hist) )
         legendEntries.append( [hist, name, "f"] )
         #logging.debug( "Adding mc histogram to stack: %s (color = %d )" % (name, color) )
         pass
@@ -46,10 +46,7 @@ def MakeStack( outputName, request, histCache=None ):
     """
     
     # Create a canvas:
-    canvas = ROOT.TCanvas("canvas", "Canvas for plot making", 800, 600 )
-    ROOT.SetOwnership(canvas, False)
-
-    canvas.cd()
+    canvas = GetPooledCanvas()[0]
 
     # Get the data hist
     nameHistList = []
@@ -96,6 +93,7 @@ def MakeStack( outputName, request, histCache=None ):
         raise Exception("MakeMultiplePlot PRINT")
 
 
+    ReleaseCanvas( canvas )
     del canvas
 
     return
@@ -122,10 +120,7 @@ def MakeMCDataStack( outputName, request, histCache=None ):
     """
     
     # Create a canvas:
-    canvas = ROOT.TCanvas("canvas", "Canvas for plot making", 800, 600 )
-    ROOT.SetOwnership(canvas, False)
-
-    canvas.cd()
+    canvas = GetPooledCanvas()[0]
 
     # Get the data hist
     dataHistList = GetDataNameHistList( request, histCache )
@@ -176,6 +171,7 @@ def MakeMCDataStack( outputName, request, histCache=None ):
         raise Exception("MakeMultiplePlot PRINT")
 
 
+    ReleaseCanvas( canvas )
     del canvas
 
     return
@@ -210,7 +206,7 @@ def DrawStack( nameHistList, request={} ):
     addedSamples = None
     for (name, hist) in nameHistList:
         if addedSamples:
-            addedSamples.Add ( hist )
+            addedSamples.Add ( Materialize(hist) )
         else:
             addedSamples = hist.Clone()
         pass
@@ -234,7 +230,7 @@ def DrawStack( nameHistList, request={} ):
         # mchist.SetFillColor(color)
         # mchist.SetLineColor(color)
         logging.debug( "DrawMCDataStack - Adding Hist to stack: %s %s" % (name, hist) )
-        stack.Add( hist )
+        stack.Add( Materialize(hist) )
         legendEntries.append( [hist, name, "f"] )
         #logging.debug( "Adding mc histogram to stack: %s (color = %d )" % (name, color) )
         pass
@@ -1,6 +1,8 @@
 
 import sys
 
+from tools import Materialize
+
 def DrawRatioPlot(request, mcList, denom_pair):
 
     denom = denom_pair[1]
@@ -34,7 +36,7 @@ def DrawRatioPlot(request, mcList, denom_pair):
 
     for (name, hist) in mcList:
         ratio = hist.Clone(hist.GetName() + "_ratio")        
-        ratio.Divide(denom)
+        ratio.Divide(Materialize(denom))
         ratio_min = min(ratio_min, ratio.GetMinimum())
         ratio_max = max(ratio_max, ratio.GetMaximum())
         #ratio.SetAxisRange( 0, 2, "Y" )
@@ -4,9 +4,20 @@ import ROOT
 import logging
 import sys, os
 import math
+import time
+import itertools
+import json
+import hashlib
 
 from collections import Iterable
 
+# Import native OrderedDict, or use
+# local version for python < 2.7
+if sys.version_info >= (2, 7):
+    from collections import OrderedDict
+else:
+    from OrderedDict import *
+
 from HistCollector import *
 
 
@@ -32,6 +43,16 @@ def ParseOptionalArgs( kwargs ):
     + YAxisTitle="EventsPerBin"
     + Normalize=True 
     + Rebin=2
+    + LazyHists=True
+    + ParallelFormats=True
+
+    With LazyHists, reading a histogram is put off until
+    its bins are first needed (see :py:class:`LazyHist`)
+
+    With several Formats and ParallelFormats=True, they're
+    saved at the same time by forked processes (see
+    :py:func:`PrintCanvasParallel`).  Forking costs more
+    than it saves unless a format is slow (eg png).
 
     """
 
@@ -44,7 +65,8 @@ def ParseOptionalArgs( kwargs ):
         SupportedRequestOptions = ["Formats", "SuppressLegend",
                                    "DrawErrors", "UseLogScale", 
                                    "Minimum", "Maximum", "LegendBoundaries",
-                                   "RatioPlot", "UseCurrentCanvas", "CanvasTitle"]
+                                   "RatioPlot", "UseCurrentCanvas", "CanvasTitle",
+                                   "LazyHists", "ParallelFormats"]
         if key in SupportedRequestOptions:
             requestOptions[key] = val
 
@@ -63,15 +85,68 @@ def ParseOptionalArgs( kwargs ):
     return (requestOptions, plotOptions)
 
 
-def GetAndStyleHist( plot, histCache=None ):
+def GetAndStyleHist( plot, histCache=None, lazy=False ):
     """ Get a histogram, apply style
 
+    If lazy, return a :py:class:`LazyHist` that
+    only does this once the histogram is used
     """
+    if lazy:
+        return LazyHist( plot, histCache )
     hist = GetHist( plot, histCache )
     hist = StyleHist( hist, plot )
     return hist
 
 
+def GetHistName( plot ):
+    """ Return the full name of a plot's histogram in its files
+
+    Add the sample's prefix and fill in
+    the sample name for {{Sample}}
+    """
+    histName = plot["Hist"]
+    if plot.get("Prefix"):
+        histName = plot["Prefix"] + histName
+
+    if "{{Sample}}" in histName:
+        histName = histName.replace("{{Sample}}", plot["SampleName"])
+
+    return histName
+
+
+def GetFileHistMap( requests, histCache=None ):
+    """ Return the histograms a list of requests will read
+
+    Return an OrderedDict mapping each file to
+    the list of (full) histogram names that
+    :py:func:`GetHist` will read from it
+    """
+    if histCache == None:
+        histCache = HistCollector()
+
+    fileHistMap = OrderedDict()
+    for request in requests:
+        for plot in request["Plots"]:
+
+            # Some plots are given their TH1's directly
+            if not isinstance( plot["Hist"], basestring ):
+                continue
+
+            histName = GetHistName( plot )
+
+            files = plot.get("FileList")
+            if not files:
+                files = histCache.Glob( plot["Files"] )
+
+            for file in files:
+                if file not in fileHistMap:
+                    fileHistMap[ file ] = []
+                if histName not in fileHistMap[ file ]:
+                    fileHistMap[ file ].append( histName )
+
+    return fileHistMap
+
+
 def GetHist( plot, histCache=None ):
     """ Get, style, and return a single histogram
 
@@ -80,27 +155,26 @@ def GetHist( plot, histCache=None ):
     files, so add those component
     histograms if necessary.
     Style the histogram and return.
+
+    The merged histogram is memoized in the
+    histCache, so asking for the same histogram
+    from the same files again only costs a copy.
     """
 
     # If not provided, create a chache
+    # (and close its files when we're done)
+    ownCache = False
     if histCache == None:
         histCache = HistCollector()
+        ownCache = True
 
     # Get the histName of the histogram
-    histName = plot["Hist"]
-    if plot.get("Prefix"):
-        histName = plot["Prefix"] + histName
-
-    if "{{Sample}}" in histName:
-        histName = histName.replace("{{Sample}}", plot["SampleName"])
+    histName = GetHistName( plot )
 
     logging.debug( "GetAndStyleHist: Getting Hist: %s" % histName )
     
-    if "FileList" not in plot:
-        plot["FileList"] = glob.glob( plot["Files"] )
-
-    if len(plot["FileList"]) == 0:
-        plot["FileList"] = glob.glob( plot["Files"] )
+    if "FileList" not in plot or len(plot["FileList"]) == 0:
+        plot["FileList"] = histCache.Glob( plot["Files"] )
 
     # If there are still no files....
     if len(plot["FileList"]) == 0:
@@ -114,27 +188,41 @@ def GetHist( plot, histCache=None ):
         print "Error: No files supplied in request: ", plot
         raise Exception("Hist Files")
 
-    totalHist = None
+    # If these files have already been
+    # merged, return a copy of that
+    totalHist = histCache.GetMergedHist( files, histName )
+    if totalHist != None:
+        logging.debug( "Returning Merged Hist: %s Entries: %s Integral: %s" % (totalHist, totalHist.GetEntries(), totalHist.Integral() ) )
+        return totalHist
 
-    for file in files:
+    # Large file lists may be merged
+    # by several processes at once
+    totalHist = histCache.MergeHistParallel( files, histName )
+    if totalHist == None:
+        for file in files:
 
-        logging.debug( "Opening File: %s" % file )
-        try:
-            hist = histCache.GetHist( file, histName )
-        except:
-            raise 
-        if hist == None:
-            print "Error: hist (%s, %s) is NONE" % (histName, file)
-            raise Exception("Hist")
-        if not totalHist:
-            ROOT.gROOT.cd()
-            totalHist = hist.Clone( histName )
-        else:
-            totalHist.Add( hist )
-            pass
+            logging.debug( "Opening File: %s" % file )
+            try:
+                hist = histCache.GetHist( file, histName )
+            except:
+                raise 
+            if hist == None:
+                print "Error: hist (%s, %s) is NONE" % (histName, file)
+                raise Exception("Hist")
+            if not totalHist:
+                ROOT.gROOT.cd()
+                totalHist = hist.Clone( histName )
+            else:
+                totalHist.Add( hist )
+                pass
         
-        hist.Delete()
-        pass
+            hist.Delete()
+            pass
+
+    if ownCache:
+        histCache.CloseAllFiles()
+    else:
+        histCache.CacheMergedHist( files, histName, totalHist )
 
     logging.debug( "Returning Total Hist: %s Entries: %s Integral: %s" % (totalHist, totalHist.GetEntries(), totalHist.Integral() ) )
 
@@ -142,6 +230,86 @@ def GetHist( plot, histCache=None ):
 
 
 
+class LazyHist( object ):
+    """ A handle to a histogram that is only read when used
+
+    It records the plot (which holds the file list,
+    the histogram name, prefix, scale and style options)
+    and any Scale or Set... calls made on it.  The
+    histogram is only read, merged and styled (by
+    :py:func:`GetAndStyleHist`) when one of its other
+    methods is first called, eg when it is drawn or its
+    bins or binning are looked at.
+
+    This only puts reads off, it doesn't avoid them:
+    the plotting helpers look at the bins of every
+    histogram (eg in :py:func:`CompareHistograms`)
+    before drawing.  What is saved is reading the
+    histograms of a request that fails or is
+    skipped before then.
+
+    ROOT functions taking a histogram as an argument
+    need the real TH1: pass them :py:func:`Materialize` (hist)
+    """
+
+    def __init__( self, plot, histCache=None ):
+        self.Plot = plot
+        self.HistCache = histCache
+        self.Operations = []
+        self.Hist = None
+
+    def Scale( self, *args ):
+        if self.Hist == None:
+            self.Operations.append( ("Scale", args) )
+            return
+        self.Hist.Scale( *args )
+
+    def Defer( self, method ):
+        """ Return a function recording a call to do once read
+
+        """
+        def Record( *args ):
+            if self.Hist == None:
+                self.Operations.append( (method, args) )
+                return
+            getattr( self.Hist, method )( *args )
+        return Record
+
+    def GetTH1( self ):
+        """ Read, style and return the histogram (only once)
+
+        """
+        if self.Hist == None:
+            logging.debug( "LazyHist: Materializing Hist: %s" % self.Plot["Hist"] )
+            hist = GetAndStyleHist( self.Plot, self.HistCache )
+            for (method, args) in self.Operations:
+                getattr( hist, method )( *args )
+            self.Hist = hist
+        return self.Hist
+
+    def IsMaterialized( self ):
+        return self.Hist != None
+
+    def __getattr__( self, attr ):
+        # Don't read the hist just to
+        # answer python's own questions
+        if attr.startswith( "__" ):
+            raise AttributeError( attr )
+        # Nor to style it (setters return nothing)
+        if attr.startswith( "Set" ) and self.Hist == None:
+            return self.Defer( attr )
+        return getattr( self.GetTH1(), attr )
+
+
+def Materialize( hist ):
+    """ Return the TH1 behind a hist that may be a LazyHist
+
+    """
+    if isinstance( hist, LazyHist ):
+        return hist.GetTH1()
+    return hist
+
+
 def StyleHist( hist, plot ):
     """ Style a histogram and return it
 
@@ -258,7 +426,7 @@ def GetDataNameHistList( request, histCache=None ):
         else:
             name = plot["Hist"]
 
-        dhist = GetAndStyleHist( plot, histCache )
+        dhist = GetAndStyleHist( plot, histCache, request.get("LazyHists") )
         logging.debug( "GetDataHist - \t Got Data Hist %s %s" % (name, dhist) )
         dataHistList.append( (name, dhist) )
 
@@ -280,7 +448,7 @@ def GetMCNameHistList( request, histCache=None ):
     mcHistList = []
     for plot in request["Plots"]:
         if plot["Type"] != "MC": continue
-        hist = GetAndStyleHist( plot )
+        hist = GetAndStyleHist( plot, histCache, request.get("LazyHists") )
         if "Title" in plot:
             name = plot["Title"]
         elif "Name" in plot:
@@ -329,7 +497,7 @@ def GetBSMNameHistList( request, histCache=None ):
     bsmHistList = []
     for plot in request["Plots"]:
         if plot["Type"] != "BSM": continue
-        hist = GetAndStyleHist( plot )
+        hist = GetAndStyleHist( plot, histCache, request.get("LazyHists") )
         if "Title" in plot:
             name = plot["Title"]
         elif "Name" in plot:
@@ -382,7 +550,7 @@ def GetNameHistList( request, histCache=None ):
             name = plot["Name"]
         else:
             name = plot["Hist"]
-        hist = GetAndStyleHist( plot )
+        hist = GetAndStyleHist( plot, histCache, request.get("LazyHists") )
 
         # Scale MC by Lumi if necessary
         ScaleHist( hist, plot, request )
@@ -444,36 +612,160 @@ def MakeCanvas(request):
     If a Ratio Plot is requested, we also
     return the ratio plot
 
+    The canvas (and its pads) come from the
+    canvas pool: call :py:func:`ReleaseCanvas`
+    once it has been saved.
     """
 
-    bottom_min = .05
-    top_min = .25
-
     if request.get("UseCurrentCanvas"):
         canvas = ROOT.gPad.cd() # ROOT.gPad.GetCanvas() #ROOT.GetSelectedPad()
-    else:
-        ROOT.gROOT.cd()
-        canvas = ROOT.TCanvas("canvas", "Canvas for plot making", 800, 600 )
-        canvas.cd()
-
-    if not request.get("RatioPlot"):
         return (canvas, None, None)
+
+    return GetPooledCanvas( request.get("RatioPlot") == True )
+
+
+#
+# The canvas pool
+#
+# Making a TCanvas (and its pads) costs more than
+# drawing a small plot, so canvases are made once
+# per layout and reused: released canvases are cleared
+# and handed to the next plot with the same layout.
+#
+
+# Layout -> list of (canvas, TopPad, BottomPad) not in use
+CanvasPool = {}
+
+# Canvas name -> (layout, (canvas, TopPad, BottomPad)) in use
+CanvasesInUse = {}
+
+CanvasWidth = 800
+CanvasHeight = 600
+
+# Numbers the pooled canvases
+# (canvases with the same name replace each other)
+CanvasCounter = itertools.count()
+
+
+def GetPooledCanvas( ratio=False, width=CanvasWidth, height=CanvasHeight ):
+    """ Return a cleared (canvas, TopPad, BottomPad) of a layout
+
+    Without a ratio plot, the pads are None.
+    The canvas is cd'ed to (or its top pad,
+    with a ratio plot).
+    """
+
+    layout = ( bool(ratio), width, height )
+
+    free = CanvasPool.setdefault( layout, [] )
+    if len( free ) > 0:
+        entry = free.pop()
     else:
-        BottomPad = ROOT.TPad("BottomPad","BottomPad", 0.0, bottom_min, 1.0, top_min);
-        BottomPad.SetTopMargin(.1);
-        BottomPad.SetBottomMargin(.1);
-        canvas.cd()
-        BottomPad.Draw();
-        
-        TopPad = ROOT.TPad("TopPad","TopPad", 0.0, top_min, 1.0, 1.0);
-        TopPad.SetTopMargin(.05);
-        TopPad.SetBottomMargin(.1);
+        entry = NewPooledCanvas( layout )
+
+    (canvas, TopPad, BottomPad) = entry
+    CanvasesInUse[ canvas.GetName() ] = ( layout, entry )
+
+    if TopPad == None:
         canvas.cd()
-        TopPad.Draw();
+    else:
         TopPad.cd()
+
+    return entry
+
+
+def NewPooledCanvas( layout ):
+    """ Make a canvas (and pads) for the pool
+
+    Used internally
+    """
+
+    (ratio, width, height) = layout
+
+    bottom_min = .05
+    top_min = .25
+
+    name = "canvas_%s" % CanvasCounter.next()
+    logging.debug( "Making pooled canvas %s for layout %s" % (name, layout) )
+
+    ROOT.gROOT.cd()
+    canvas = ROOT.TCanvas( name, "Canvas for plot making", width, height )
+    ROOT.SetOwnership( canvas, False )
+    canvas.cd()
+
+    if not ratio:
+        return (canvas, None, None)
+
+    BottomPad = ROOT.TPad("BottomPad","BottomPad", 0.0, bottom_min, 1.0, top_min);
+    ROOT.SetOwnership( BottomPad, False )
+    BottomPad.SetTopMargin(.1);
+    BottomPad.SetBottomMargin(.1);
+    canvas.cd()
+    BottomPad.Draw();
+
+    TopPad = ROOT.TPad("TopPad","TopPad", 0.0, top_min, 1.0, 1.0);
+    ROOT.SetOwnership( TopPad, False )
+    TopPad.SetTopMargin(.05);
+    TopPad.SetBottomMargin(.1);
+    canvas.cd()
+    TopPad.Draw();
+
     return (canvas, TopPad, BottomPad)
 
 
+def ReleaseCanvas( canvas ):
+    """ Clear a canvas and give it back to the pool
+
+    Everything drawn on it is removed (objects
+    it doesn't own are left to their owners)
+    and what was changed by drawing (log scale,
+    title) is reset.  Canvases not from
+    the pool are closed.
+    """
+
+    name = canvas.GetName()
+    if name not in CanvasesInUse:
+        canvas.Close()
+        return
+
+    (layout, entry) = CanvasesInUse.pop( name )
+    (canvas, TopPad, BottomPad) = entry
+
+    if TopPad == None:
+        canvas.Clear()
+    else:
+        for pad in (TopPad, BottomPad):
+            pad.Clear()
+            pad.SetLogy( 0 )
+    canvas.SetLogy( 0 )
+    canvas.SetTitle( "Canvas for plot making" )
+    ROOT.gROOT.cd()
+
+    CanvasPool[ layout ].append( entry )
+
+
+def ReleaseAllCanvases():
+    """ Release every pooled canvas in use
+
+    For example after a plot failed
+    before releasing its canvas
+    """
+    for (layout, (canvas, TopPad, BottomPad)) in CanvasesInUse.values():
+        ReleaseCanvas( canvas )
+
+
+def ClearCanvasPool():
+    """ Close and forget every canvas in the pool
+
+    Canvases in use are left to be released
+    """
+    for entries in CanvasPool.values():
+        for (canvas, TopPad, BottomPad) in entries:
+            canvas.Close()
+            ROOT.SetOwnership( canvas, True )
+    CanvasPool.clear()
+
+
 # Possibly unnecessary
 # Candidate for deprecation
 def MakeLegend( legendEntries, request ):
@@ -508,7 +800,7 @@ def MakeLegend( legendEntries, request ):
     # show the stacked histograms in the same order
     for (hist, name, style) in legendEntries: 
         logging.debug( "Legend Entries: %s %s %s" % (hist, name, style) )
-        legend.AddEntry( hist, name, style )
+        legend.AddEntry( Materialize(hist), name, style )
 
 
     return legend
@@ -746,42 +1038,293 @@ def PrintCanvas( canvas, outputName ):
         canvas.Print( outputName  )
 
 
-def SaveCanvas( canvas, request, outputName ):
-    """ Save a canvas
+# Format -> seconds spent saving canvases
+# in it (see SaveCanvas), since last popped
+FormatTimes = OrderedDict()
 
-    Determine the type from the name
-    Add an outputdir if in request
+
+def PopFormatTimes():
+    """ Return and reset the time spent saving each format
+
+    Return an OrderedDict of format -> seconds
     """
-    
+    times = OrderedDict( FormatTimes )
+    FormatTimes.clear()
+    return times
+
+
+def AddFormatTime( outputName, elapsed ):
+    """ Count the time taken to save a file of a format
+
+    Used internally
+    """
+    format = os.path.splitext( outputName )[1].lstrip( "." )
+    FormatTimes[ format ] = FormatTimes.get( format, 0.0 ) + elapsed
+
+
+def PrintCanvasTimed( canvas, outputName ):
+    """ Save a canvas and return the seconds taken
+
+    """
+    start = time.time()
+    PrintCanvas( canvas, outputName )
+    return time.time() - start
+
+
+def PrintCanvasInChild( canvas, outputName, connection ):
+    """ Save a canvas in a child process, sending back the time taken
+
+    Used internally
+    """
+    try:
+        connection.send( PrintCanvasTimed( canvas, outputName ) )
+    finally:
+        connection.close()
+
+
+def CanPrintInChildren():
+    """ Return whether this process can fork processes to save canvases
+
+    Processes of a multiprocessing pool
+    (eg render workers) can't
+    """
+    import multiprocessing
+    return not multiprocessing.current_process().daemon
+
+
+def PrintCanvasParallel( canvas, outputNames ):
+    """ Save an already drawn canvas to several files at once
+
+    The first file is saved here while each other is saved
+    by a forked process, which starts with the canvas as
+    drawn here, so saving costs about as much as the
+    slowest format rather than all of them.
+    Return a list of (outputName, seconds), with
+    None for the time of a process that failed.
+    """
+
+    import multiprocessing
+
+    children = []
+    for outputName in outputNames[1:]:
+        (receiver, sender) = multiprocessing.Pipe( False )
+        child = multiprocessing.Process( target=PrintCanvasInChild, args=(canvas, outputName, sender) )
+        child.start()
+        sender.close()
+        children.append( (outputName, child, receiver) )
+
+    timings = [ (outputNames[0], PrintCanvasTimed( canvas, outputNames[0] )) ]
+
+    for (outputName, child, receiver) in children:
+        elapsed = None
+        try:
+            elapsed = receiver.recv()
+        except EOFError:
+            pass
+        receiver.close()
+        child.join()
+        timings.append( (outputName, elapsed) )
+
+    return timings
+
+
+def GetOutputNames( request, outputName=None ):
+    """ Return the files a request's canvas is saved to
+
+    Add an outputdir if in request, and
+    one file per format if formats are given
+    """
+
+    if outputName == None:
+        outputName = request["OutputName"]
+
     if "OutputDir" in request:
         dir = request["OutputDir"]
         if dir!= "":
             outputName = dir + '/' + outputName
         pass
-        
+
     if "Formats" in request:
         if '.' in outputName:
             outputNameBase = outputName[ : outputName.rfind('.') ]
         else:
             outputNameBase = outputName
-        for format in request["Formats"]:
-            FullName = outputNameBase + '.' + format
-            # print "Saving Canvas as: ", FullName
-            PrintCanvas( canvas, FullName )
-            if not os.path.exists( FullName ):
-                print "Error -  Failed to make the following output: %s" % FullName
-                raise Exception("Saving Canvas PRINT")
-            pass
-        pass
-            
+        return [ outputNameBase + '.' + format for format in request["Formats"] ]
+
+    return [ outputName ]
+
+
+# The PlotBook canvases are added to,
+# rather than saved (see SetCurrentBook)
+CurrentBook = None
+
+
+def SetCurrentBook( book ):
+    """ Make SaveCanvas add pages to a book instead of saving files
+
+    'book' is a :py:class:`PlotBook.PlotBook`,
+    or None to save files again
+    """
+    global CurrentBook
+    CurrentBook = book
+
+
+def SaveCanvas( canvas, request, outputName ):
+    """ Save a canvas
+
+    Determine the type from the name
+    Add an outputdir if in request
+
+    If a book is set (see :py:func:`SetCurrentBook`),
+    add the canvas to it as a page instead
+    """
+
+    if CurrentBook != None:
+        CurrentBook.AddPage( canvas, outputName )
+        return
+
+    outputNames = GetOutputNames( request, outputName )
+
+    # The canvas is drawn once: with several formats,
+    # save them all at once (see PrintCanvasParallel)
+    if len( outputNames ) > 1 and request.get("ParallelFormats", False) and CanPrintInChildren():
+        timings = PrintCanvasParallel( canvas, outputNames )
     else:
-        PrintCanvas( canvas, outputName)
-        if not os.path.exists( outputName ):
-            print "Error -  Failed to make the following output: %s" % outputName
+        timings = [ (FullName, PrintCanvasTimed( canvas, FullName )) for FullName in outputNames ]
+
+    for (FullName, elapsed) in timings:
+        if elapsed == None or not os.path.exists( FullName ):
+            print "Error -  Failed to make the following output: %s" % FullName
             raise Exception("Saving Canvas PRINT")
-        pass
-    
+        logging.debug( "SaveCanvas - \t Saved %s in %.3f s" % (FullName, elapsed) )
+        AddFormatTime( FullName, elapsed )
+
     return
+
+
+def GetFingerprintPath( request ):
+    """ Return the file holding the fingerprint of a request's outputs
+
+    It sits next to the (first) output
+    """
+    outputName = GetOutputNames( request )[0]
+    if '.' in os.path.basename( outputName ):
+        outputName = outputName[ : outputName.rfind('.') ]
+    return outputName + ".fingerprint"
+
+
+def GetRequestFingerprint( request, histCache=None, fileKeys=None ):
+    """ Return a digest of everything a request's outputs depend on
+
+    That is the request itself (samples, style options,
+    lumi, etc) and the path, size and mtime of each of
+    its input files.  Changes to the plotting code
+    itself aren't seen.  Return None if the request
+    holds TH1's or its files can't all be found.
+
+    'fileKeys' is a dictionary in which to remember
+    the files of each sample between calls, so that
+    requests sharing samples only stat them once.
+    """
+
+    if histCache == None:
+        histCache = HistCollector()
+    if fileKeys == None:
+        fileKeys = {}
+
+    plots = []
+    for plot in request["Plots"]:
+        if not isinstance( plot["Hist"], basestring ):
+            return None
+        digest = GetFilesDigest( plot, histCache, fileKeys )
+        if digest == None:
+            return None
+        # Fingerprint the digest of the files
+        # rather than the (long) list of them
+        plot = dict( plot.items() )
+        plot["FileList"] = digest
+        plots.append( plot )
+
+    contents = dict( [ (key, value) for (key, value) in request.iteritems() if key != "Fingerprint" ] )
+    contents["Plots"] = plots
+    text = json.dumps( contents, sort_keys=True, default=GetFingerprintValue )
+    return hashlib.sha1( text ).hexdigest()
+
+
+def GetFilesDigest( plot, histCache, fileKeys ):
+    """ Return a digest of the path, size and mtime of a plot's files
+
+    Return None if they can't all be found.  The
+    digest of each list of files (and the key of
+    each file) is remembered in 'fileKeys'.
+    """
+
+    fileList = plot.get("FileList")
+    if fileList:
+        source = ("FileList", tuple( fileList ))
+    else:
+        source = ("Files", plot["Files"])
+    if source in fileKeys:
+        return fileKeys[ source ]
+
+    if not fileList:
+        fileList = histCache.Glob( plot["Files"] )
+
+    keys = []
+    for file in fileList:
+        key = fileKeys.get( ("File", file) )
+        if key == None:
+            try:
+                stat = os.stat( file )
+            except OSError:
+                fileKeys[ source ] = None
+                return None
+            key = (os.path.realpath( file ), stat.st_size, stat.st_mtime)
+            fileKeys[ ("File", file) ] = key
+        keys.append( key )
+
+    digest = hashlib.sha1( json.dumps( sorted( set( keys ) ) ) ).hexdigest()
+    fileKeys[ source ] = digest
+    return digest
+
+
+def GetFingerprintValue( value ):
+    """ Return what to fingerprint for a value json can't write
+
+    Plots and samples (see :py:mod:`Samples`)
+    are fingerprinted as dictionaries
+    """
+    if hasattr( value, "ToDict" ):
+        return value.ToDict()
+    return repr( value )
+
+
+def IsUpToDate( request, fingerprint ):
+    """ Return whether a request's outputs exist and match a fingerprint
+
+    """
+    for outputName in GetOutputNames( request ):
+        if not os.path.exists( outputName ):
+            return False
+
+    path = GetFingerprintPath( request )
+    if not os.path.exists( path ):
+        return False
+    input = open( path )
+    stored = input.read().strip()
+    input.close()
+
+    return stored == fingerprint
+
+
+def WriteFingerprint( request ):
+    """ Store a request's fingerprint next to its outputs
+
+    Call once the outputs have been saved
+    """
+    output = open( GetFingerprintPath( request ), "w" )
+    output.write( request["Fingerprint"] + "\n" )
+    output.close()
     
 def GetBinValue( hist, binName ):
     """ Return the value of a bin by name
@@ -150,22 +150,27 @@ def main():
 def ExtendHistList( Directory, PathHistList ):
     """ Use Recursion to get list of (directory, hist)
     
+    Only histograms are read: the class of every
+    other object is known from its key alone.
     """
 
     keys = Directory.GetListOfKeys()
 
     for key in keys:
 
-        obj = key.ReadObj()
+        keyClass = ROOT.TClass.GetClass( key.GetClassName() )
+        if not keyClass:
+            continue
 
-        if( obj.IsA().InheritsFrom("TH1") ):
+        if( keyClass.InheritsFrom("TH1") ):
+            obj = key.ReadObj()
             fullPath = Directory.GetPath()
             fullPath = fullPath[ fullPath.find(":/") + 2 : ]
             fullPath += '/' + obj.GetName()
             PathHistList.append( (fullPath, obj) )
 
-        if( obj.IsA().InheritsFrom("TDirectory") ):
-            ExtendHistList( obj, PathHistList )
+        if( keyClass.InheritsFrom("TDirectory") ):
+            ExtendHistList( Directory.GetDirectory( key.GetName() ), PathHistList )
 
         pass
     
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import logging
+
+
+def main():
+    """ Run one shard of the requests exported by a PlotMaker
+
+    The requests are written by PlotMaker.ExportRequests.
+    Each of N jobs (eg on a batch farm) runs:
+
+    runShard.py requests.json --shard i/N
+
+    with i from 0 to N-1, and makes its share of the
+    plots (balanced by the number of files and
+    histograms each request reads).  A manifest of the
+    shard's results (outputs, time and any error of
+    each request) is written as it goes along, as JSON
+    lines: the shard, then one line per request, then
+    a last line with "Complete" and "NumFailed".
+    """
+
+    # Read the command line options:
+    import optparse
+    desc = "This script makes the plots of one shard of the" \
+           " requests exported by PlotMaker.ExportRequests"
+
+    vers = "$Revision: 00001 $"
+
+    parser = optparse.OptionParser( description = desc, version = vers,
+                                    usage = "%prog [options] requests.json" )
+
+    parser.add_option( "-s", "--shard", dest = "shard",
+                       action = "store", type = "string",
+                       default = "0/1", help = "Shard to run, as i/N with i from 0 to N-1" )
+
+    parser.add_option( "-m", "--manifest", dest = "manifest",
+                       action = "store", type = "string",
+                       default = "", help = "Name of the manifest file (default: requests.shard-i-of-N.jsonl)" )
+
+    parser.add_option( "-c", "--cache-dir", dest = "cacheDir",
+                       action = "store", type = "string",
+                       default = "", help = "Directory in which to cache histograms" )
+
+    parser.add_option( "-w", "--workers", dest = "workers",
+                       action = "store", type = "int",
+                       default = 1, help = "Number of processes reading histograms" )
+
+    parser.add_option( "-p", "--prefetch", dest = "prefetch",
+                       action = "store", type = "int",
+                       default = 0, help = "Number of requests to read ahead" )
+
+    parser.add_option( "-r", "--render-workers", dest = "renderWorkers",
+                       action = "store", type = "int",
+                       default = 0, help = "Number of processes drawing plots" )
+
+    parser.add_option( "-b", "--book", dest = "book",
+                       action = "store", type = "string",
+                       default = "", help = "Add the plots as pages of multi-page PDFs with this name (eg plots.pdf)" )
+
+    parser.add_option( "-i", "--incremental", action="store_true", dest="incremental", help="Skip plots that are up to date")
+    parser.add_option( "-v", "--verbose",     action="store_true", dest="verbose",     help="Set Output Mode to Verbose")
+
+    # Parse the command line options:
+    ( options, args ) = parser.parse_args()
+
+    if len(args) < 1:
+        print "Error: Must have at least one argument: the requests file"
+        return 1
+
+    requestsFile = args[0]
+
+    try:
+        (shard, numShards) = [ int(part) for part in options.shard.split("/") ]
+    except ValueError:
+        print "Error: Shard must be given as i/N, not: %s" % options.shard
+        return 1
+
+    if numShards < 1 or shard < 0 or shard >= numShards:
+        print "Error: Shard must be given as i/N with N >= 1 and i from 0 to N-1, not: %s" % options.shard
+        return 1
+
+    manifestFile = options.manifest
+    if manifestFile == "":
+        base = requestsFile
+        if base.endswith( ".json" ):
+            base = base[ : -len(".json") ]
+        manifestFile = "%s.shard-%s-of-%s.jsonl" % (base, shard, numShards)
+
+    import ROOT
+    ROOT.gROOT.SetBatch( True )
+
+    from PlotMaker import PlotMaker
+
+    plotMaker = PlotMaker()
+    if options.verbose:
+        plotMaker.SetLevelDebug()
+    if options.cacheDir != "":
+        plotMaker.SetCacheDir( options.cacheDir )
+    plotMaker.SetNumWorkers( options.workers )
+
+    numRequests = plotMaker.ImportRequests( requestsFile, shard, numShards )
+    print "Running shard %s of %s: %s requests" % (shard, numShards, numRequests)
+
+    StartManifest( manifestFile, { "RequestsFile" : requestsFile, "Shard" : shard,
+                                   "NumShards" : numShards, "NumRequests" : numRequests } )
+
+    # Each shard writes its own book
+    book = None
+    if options.book != "":
+        book = options.book
+        if book.endswith( ".pdf" ):
+            book = book[ : -len(".pdf") ]
+        if numShards > 1:
+            book = "%s.shard-%s-of-%s" % (book, shard, numShards)
+
+    numMade = 0
+    numFailed = 0
+    for result in plotMaker.IterGeneratePlotsInCache( prefetch=options.prefetch,
+                                                      renderWorkers=options.renderWorkers,
+                                                      incremental=options.incremental,
+                                                      book=book ):
+        if result["Error"] != None:
+            numFailed += 1
+            print "Error: Failed to make %s:\n%s" % (result["OutputName"], result["Error"])
+        else:
+            numMade += 1
+        AppendManifest( manifestFile, result )
+
+    AppendManifest( manifestFile, { "Complete" : True, "NumMade" : numMade, "NumFailed" : numFailed } )
+
+    print "Shard %s of %s done: %s plots made, %s failed (see %s)" \
+        % (shard, numShards, numMade, numFailed, manifestFile)
+
+    if numFailed > 0:
+        return 1
+    return 0
+
+
+def StartManifest( fileName, header ):
+    """ Start (or restart) a shard's manifest with its first line
+
+    """
+    tmpName = "%s.%s.tmp" % (fileName, os.getpid())
+    output = open( tmpName, "w" )
+    output.write( json.dumps( header ) + "\n" )
+    output.close()
+    os.rename( tmpName, fileName )
+
+
+def AppendManifest( fileName, entry ):
+    """ Add a line to a shard's manifest
+
+    Only the new line is written, however
+    long the manifest already is
+    """
+    output = open( fileName, "a" )
+    output.write( json.dumps( entry ) + "\n" )
+    output.close()
+
+
+if __name__ == "__main__":
+    sys.exit( main() )